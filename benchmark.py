@@ -0,0 +1,392 @@
+# benchmark
+#
+# Times the stages of the sav2json -> json2sss pipeline on datasets generated
+# by datagen, of increasing numbers of cases and variables:
+#
+#	header_load		reading the SAV dictionary
+#	data_pass		reading every case of the SAV file
+#	distributions	sav2json.SAVDataset, reading the cases and building the
+#					classified distribution of each variable
+#	json_emission	SAVDataset.writeJSON, writing the JSON text with the data
+#	sss_allocate	json2sss.SSSAllocate
+#	xml				writing the Triple-S XML
+#	asc, csv		writing the Triple-S data files
+#	jsonsummary		running jsonsummary on the JSON file
+#
+# Each stage runs in a fresh interpreter of its own, after any setup (e.g.
+# loading the JSON file) that is not part of the stage, so that its peak
+# memory, which includes that of the interpreter and the setup but nothing of
+# the benchmark process, can be measured. The SAV stages, distributions and
+# json_emission need the IBM SPSS I/O module and jsonsummary needs openpyxl;
+# stages that can't run are recorded as skipped.
+#
+# The seconds, throughput (cases/s, cells/s and MB/s of the file read or
+# written) and peak memory of every stage are written to a JSON results file,
+# and may be compared with the results of an earlier run. A stage that takes
+# longer, or needs more memory, than the baseline by more than the threshold
+# is reported as a regression, and the exit status is then 1.
+
+import datetime
+import exceptions
+import imp
+import json
+import os
+import os.path
+import subprocess
+import sys
+import time
+
+import datagen
+import json2sss
+import sav2json
+import savdllwrapper
+
+from version import savutilName, savutilVersion
+
+try:
+	import resource
+	resourceOk = True
+except ImportError:
+	resourceOk = False
+
+stageNames = ["header_load", "data_pass", "distributions", "json_emission",
+	"sss_allocate", "xml", "asc", "csv", "jsonsummary"]
+
+# Timings of less than this many seconds are too noisy to compare
+noiseSeconds = 0.05
+
+class StageUnavailable (exceptions.Exception):
+	pass
+
+# The shape specification of a dataset of about width variables, in the
+# proportions of a typical survey
+def benchmarkSpec (cases, width):
+	def share (fraction):
+		return max (1, int (width*fraction))
+	return {
+		"cases": cases,
+		"title": "Benchmark %d x %d" % (cases, width),
+		"weight": True,
+		"variables": [
+			{"kind": "id"},
+			{"kind": "categorical", "count": share (0.5), "categories": 12,
+				"skew": 1.2, "missing": 0.05},
+			{"kind": "integer", "count": share (0.1), "min": 0, "max": 1000},
+			{"kind": "decimal", "count": share (0.1), "mean": 50, "sd": 15},
+			{"kind": "text", "count": share (0.05), "width": 500, "words": 40,
+				"missing": 0.3},
+			{"kind": "date", "count": share (0.05)},
+			{"kind": "multresp", "count": share (0.03), "items": 5}
+		]
+	}
+
+def loadJSON (jsonFilename):
+	with open (jsonFilename) as f:
+		return json.load (f)
+
+def ioModuleCheck (savFilename):
+	try:
+		savdllwrapper.SavHeaderReader (savFilename, ioUtf8=True).close ()
+	except OSError, e:
+		raise StageUnavailable, "IBM SPSS I/O module not available (%s)" % e
+
+# Each stage does its setup and returns the function to be timed and the
+# name of the file whose size gives MB/s
+
+def headerLoadStage (files):
+	ioModuleCheck (files ["sav"])
+	def run ():
+		with savdllwrapper.SavHeaderReader (files ["sav"], ioUtf8=True) as header:
+			header.dataDictionary ()
+	return run, files ["sav"]
+
+def dataPassStage (files):
+	ioModuleCheck (files ["sav"])
+	def run ():
+		with savdllwrapper.SavReader (files ["sav"], ioUtf8=True) as reader:
+			for record in reader:
+				pass
+	return run, files ["sav"]
+
+def distributionsStage (files):
+	ioModuleCheck (files ["sav"])
+	def run ():
+		sav2json.SAVDataset (files ["sav"])
+	return run, files ["sav"]
+
+def jsonEmissionStage (files):
+	ioModuleCheck (files ["sav"])
+	dataset = sav2json.SAVDataset (files ["sav"])
+	outputFilename = files ["root"] + "_emitted.json"
+	def run ():
+		with open (outputFilename, "wb") as f:
+			dataset.writeJSON (f, includeData=True)
+	return run, outputFilename
+
+def sssAllocateStage (files):
+	jsonData = loadJSON (files ["json"])
+	def run ():
+		json2sss.SSSAllocate (jsonData)
+	return run, files ["json"]
+
+def xmlStage (files):
+	jsonData = loadJSON (files ["json"])
+	json2sss.SSSAllocate (jsonData)
+	outputFilename = files ["root"] + "_sss.xml"
+	def run ():
+		with open (outputFilename, "w") as f:
+			json2sss.writeXMLForVariables (jsonData, f)
+	return run, outputFilename
+
+def dataFileStage (files, format):
+	jsonData = loadJSON (files ["json"])
+	json2sss.SSSAllocate (jsonData)
+	outputFilename = files ["root"] + "_sss." + format
+	def run ():
+		with open (outputFilename, "wb") as f:
+			json2sss.writeData (jsonData, f, format)
+	return run, outputFilename
+
+def ascStage (files):
+	return dataFileStage (files, "asc")
+
+def csvStage (files):
+	return dataFileStage (files, "csv")
+
+def jsonsummaryStage (files):
+	try:
+		imp.find_module ("openpyxl")
+	except ImportError:
+		raise StageUnavailable, "openpyxl not available"
+	workbookFilename = files ["root"] + "_summary.xlsx"
+	script = os.path.join (os.path.dirname (os.path.abspath (__file__)), "jsonsummary.py")
+	def run ():
+		if os.path.exists (workbookFilename):
+			os.remove (workbookFilename)
+		with open (os.devnull, "w") as devnull:
+			subprocess.check_call ([sys.executable, script, files ["json"],
+				workbookFilename], stdout=devnull)
+	return run, files ["json"]
+
+stages = {
+	"header_load": headerLoadStage,
+	"data_pass": dataPassStage,
+	"distributions": distributionsStage,
+	"json_emission": jsonEmissionStage,
+	"sss_allocate": sssAllocateStage,
+	"xml": xmlStage,
+	"asc": ascStage,
+	"csv": csvStage,
+	"jsonsummary": jsonsummaryStage
+}
+
+# Peak resident memory in MB of this process and its children, where the
+# resource module is available
+def peakMemory ():
+	if not resourceOk:
+		return None
+	peak = max (resource.getrusage (resource.RUSAGE_SELF).ru_maxrss,
+		resource.getrusage (resource.RUSAGE_CHILDREN).ru_maxrss)
+	# ru_maxrss is in bytes on OS X and in kilobytes elsewhere
+	if sys.platform == "darwin":
+		return peak/2.0**20
+	return peak/2.0**10
+
+# Runs a stage in the stage process, returning its result
+def runStage (stageName, files):
+	try:
+		run, sizeFilename = stages [stageName] (files)
+		start = time.time ()
+		run ()
+		seconds = time.time () - start
+		return {
+			"seconds": seconds,
+			"bytes": os.path.getsize (sizeFilename),
+			"peak_memory_mb": peakMemory ()
+		}
+	except StageUnavailable, e:
+		return {"skipped": str (e)}
+	except exceptions.Exception, e:
+		return {"error": "%s: %s" % (e.__class__.__name__, e)}
+
+# The stage process: a fresh interpreter rather than a fork of this one,
+# whose peak memory would include that of the benchmark process. The result
+# is the last line of its output.
+stageScript = """
+import json, sys
+sys.path.insert (0, sys.argv [1])
+import benchmark
+print
+print json.dumps (benchmark.runStage (sys.argv [2], json.loads (sys.argv [3])))
+"""
+
+def timeStage (stageName, files, nCases, nVariables, repeats=1):
+	best = None
+	for repeat in xrange (repeats):
+		process = subprocess.Popen ([sys.executable, "-c", stageScript,
+			os.path.dirname (os.path.abspath (__file__)), stageName, json.dumps (files)],
+			stdout=subprocess.PIPE)
+		output = process.communicate () [0]
+		try:
+			result = json.loads (output.splitlines () [-1])
+		except (IndexError, ValueError):
+			result = {"error": "stage process exited with code %s" %
+				process.returncode}
+		if "seconds" not in result:
+			return result
+		if best is None:
+			best = result
+		else:
+			best ["seconds"] = min (best ["seconds"], result ["seconds"])
+			if result ["peak_memory_mb"] is not None:
+				best ["peak_memory_mb"] = max (best ["peak_memory_mb"],
+					result ["peak_memory_mb"])
+	seconds = max (best ["seconds"], 1e-6)
+	best ["cases_per_second"] = nCases/seconds
+	best ["cells_per_second"] = nCases*nVariables/seconds
+	best ["mb_per_second"] = best.pop ("bytes")/2.0**20/seconds
+	return best
+
+def prepareDataset (outputPath, cases, width, seed):
+	root = os.path.join (outputPath, "bench_%dx%d_%d" % (cases, width, seed))
+	files = {"root": root, "sav": root + ".sav", "json": root + ".json"}
+	dataset = datagen.GeneratedDataset (benchmarkSpec (cases, width), seed)
+	if not os.path.exists (files ["sav"]):
+		print "..Generating %s" % files ["sav"]
+		dataset.writeSAV (files ["sav"])
+	if not os.path.exists (files ["json"]):
+		print "..Generating %s" % files ["json"]
+		dataset.writeJSON (files ["json"])
+	return files, len (dataset.varNames)
+
+def runBenchmarks (outputPath, caseCounts, widths, seed=0, repeats=1,
+	selectedStages=None):
+	results = {
+		"origin": "%s %s benchmark" % (savutilName, savutilVersion),
+		"date": datetime.datetime.now ().isoformat (),
+		"python": sys.version.split () [0],
+		"platform": sys.platform,
+		"seed": seed,
+		"datasets": {}
+	}
+	for cases in caseCounts:
+		for width in widths:
+			files, nVariables = prepareDataset (outputPath, cases, width, seed)
+			datasetResults = {
+				"cases": cases,
+				"variables": nVariables,
+				"sav_mb": os.path.getsize (files ["sav"])/2.0**20,
+				"json_mb": os.path.getsize (files ["json"])/2.0**20,
+				"stages": {}
+			}
+			for stageName in stageNames:
+				if selectedStages and stageName not in selectedStages:
+					continue
+				result = timeStage (stageName, files, cases, nVariables, repeats)
+				datasetResults ["stages"] [stageName] = result
+				if "seconds" in result:
+					print "..%dx%d %-14s %8.3fs %12.0f cells/s %8.2f MB/s %s" %\
+						(cases, nVariables, stageName, result ["seconds"],
+						 result ["cells_per_second"], result ["mb_per_second"],
+						 "" if result ["peak_memory_mb"] is None else
+						 "%.1f MB peak" % result ["peak_memory_mb"])
+				elif "skipped" in result:
+					print "..%dx%d %-14s skipped: %s" % (cases, nVariables, stageName,
+						result ["skipped"])
+				else:
+					print "--%dx%d %-14s failed: %s" % (cases, nVariables, stageName,
+						result ["error"])
+			results ["datasets"] ["%dx%d" % (cases, width)] = datasetResults
+	return results
+
+# Regressions of results against the baseline, as messages
+def regressions (results, baseline, threshold=0.1):
+	messages = []
+	for datasetName, datasetResults in sorted (results ["datasets"].items ()):
+		baseDataset = baseline.get ("datasets", {}).get (datasetName)
+		if not baseDataset:
+			continue
+		for stageName in stageNames:
+			result = datasetResults ["stages"].get (stageName, {})
+			base = baseDataset ["stages"].get (stageName, {})
+			if "error" in result and "seconds" in base:
+				messages.append ("%s %s failed: %s" % (datasetName, stageName,
+					result ["error"]))
+			if "seconds" not in result or "seconds" not in base:
+				continue
+			if base ["seconds"] >= noiseSeconds and\
+			   result ["seconds"] > base ["seconds"]*(1 + threshold):
+				messages.append ("%s %s took %.3fs against %.3fs (+%.0f%%)" %
+					(datasetName, stageName, result ["seconds"], base ["seconds"],
+					 100*(result ["seconds"]/base ["seconds"] - 1)))
+			if result ["peak_memory_mb"] and base.get ("peak_memory_mb") and\
+			   result ["peak_memory_mb"] > base ["peak_memory_mb"]*(1 + threshold):
+				messages.append ("%s %s peak memory %.1f MB against %.1f MB (+%.0f%%)" %
+					(datasetName, stageName, result ["peak_memory_mb"],
+					 base ["peak_memory_mb"],
+					 100*(result ["peak_memory_mb"]/base ["peak_memory_mb"] - 1)))
+	return messages
+
+if __name__ == "__main__":
+
+	import getopt
+
+	outputPath = "benchmark"
+	printVersion = False
+	caseCounts = [1000, 10000, 100000]
+	widths = [20, 200]
+	seed = 0
+	repeats = 1
+	baselineFilename = None
+	threshold = 0.1
+	selectedStages = None
+	updateBaseline = False
+	optlist, args = getopt.getopt(sys.argv[1:], 'b:c:n:o:r:s:t:uvw:')
+	for (option, value) in optlist:
+		if option == "-b":
+			baselineFilename = value
+		if option == "-c":
+			caseCounts = [int (count) for count in value.split (",")]
+		if option == "-n":
+			repeats = int (value)
+		if option == "-o":
+			outputPath = value
+		if option == "-r":
+			seed = int (value)
+		if option == "-s":
+			selectedStages = value.split (",")
+		if option == "-t":
+			threshold = float (value)/100
+		if option == "-u":
+			updateBaseline = True
+		if option == "-v":
+			printVersion = True
+		if option == "-w":
+			widths = [int (width) for width in value.split (",")]
+	if printVersion:
+		print "..benchmark version %s" % savutilVersion
+	for stageName in selectedStages or []:
+		if stageName not in stages:
+			print "--Unknown stage '%s'" % stageName
+			sys.exit (2)
+	if not os.path.isdir (outputPath):
+		os.makedirs (outputPath)
+	results = runBenchmarks (outputPath, caseCounts, widths, seed, repeats,
+		selectedStages)
+	resultsFilename = os.path.join (outputPath, "benchmark_results.json")
+	with open (resultsFilename, "w") as f:
+		json.dump (results, f, indent=4, sort_keys=True)
+	print "..Results written to %s" % resultsFilename
+	if baselineFilename:
+		if updateBaseline or not os.path.exists (baselineFilename):
+			with open (baselineFilename, "w") as f:
+				json.dump (results, f, indent=4, sort_keys=True)
+			print "..Baseline written to %s" % baselineFilename
+		else:
+			messages = regressions (results, loadJSON (baselineFilename), threshold)
+			for message in messages:
+				print "--Regression: %s" % message
+			if messages:
+				sys.exit (1)
+			print "..No regressions beyond %.0f%% of %s" % (100*threshold,
+				baselineFilename)
@@ -223,6 +223,83 @@ class ClassifiedUnicodeValueCache (object):
 				self.cache [value] = result
 			return result
 				
+# Sampled type inference. A column whose leading sample is all integer (or
+# integer and decimal) values is thereafter classified by a typed fast path
+# that returns the same value as ClassifiedUnicodeValue for canonically
+# formatted numbers, and _unverified for anything else. Unverified values are
+# classified in full, and a value of higher type order than the sample ends
+# the fast path for the column.
+
+class _Unverified (object):
+	pass
+_unverified = _Unverified ()
+
+# Beyond 11 digits unicode () of a float may use an exponent
+floatIntegerLimit = 1e11
+
+def fastInteger (text):
+	if not text:
+		if text is None or text == "": return None
+		return _unverified
+	if type (text) == float:
+		if text.is_integer () and -floatIntegerLimit < text < floatIntegerLimit:
+			return int (text)
+		return _unverified
+	try:
+		value = int (text)
+	except (ValueError, TypeError):
+		return _unverified
+	if unicode (value) == text: return value
+	return _unverified
+
+def fastDecimal (text):
+	value = fastInteger (text)
+	if value is not _unverified: return value
+	if type (text) == float:
+		text = unicode (text)
+	try:
+		value = float (text)
+	except (ValueError, TypeError):
+		return _unverified
+	if value.is_integer (): return _unverified
+	# Canonical texts besides decimals are exponent forms, "inf" and "nan"
+	if unicode (value) == text and "e" not in text and "n" not in text:
+		return value
+	return _unverified
+
+fastPaths = {
+	1: fastInteger,
+	2: fastDecimal
+}
+
+class SampledClassifier (object):
+	def __init__ (self, cache=None, sampleSize=1000):
+		if cache is None:
+			cache = ClassifiedUnicodeValueCache ()
+		self.cache = cache
+		self.sampleSize = sampleSize
+		self.sampled = 0
+		self.typeOrder = 0
+		self.fastPath = None
+		self.fastCount = 0
+
+	def value (self, text):
+		fastPath = self.fastPath
+		if fastPath is not None:
+			value = fastPath (text)
+			if value is not _unverified:
+				self.fastCount += 1
+				return value
+		classified = self.cache.get (text)
+		if classified.typeOrder > self.typeOrder:
+			self.typeOrder = classified.typeOrder
+			self.fastPath = None
+		if self.sampled < self.sampleSize:
+			self.sampled += 1
+			if self.sampled == self.sampleSize:
+				self.fastPath = fastPaths.get (self.typeOrder)
+		return classified.value
+
 if __name__ == "__main__":
 
 	import json
@@ -1,8 +1,10 @@
 # Convert a CSV file into a JSON object with distribution
 	
+import cStringIO
+
 import classifiedunicodevalue
-from classifiedunicodevalue import ClassifiedUnicodeValue
-from datautil import compressedValueSequence, compressedValues
+from datautil import encodedValues
+from datautil import CompressedValueEncoder, typedRuns, valueIterator
 import unicodecsv
 from version import savutilName, savutilVersion
 
@@ -26,15 +28,164 @@ def objectify (x):
 			except:
 				return x
 
+class ColumnAccumulator (object):
+	"""
+	Single pass conversion of rows into JSON variables.
+
+	Each row updates the frequency distribution and run length encoder of
+	every column, so memory is bounded by the distinct values and runs of
+	the columns rather than the number of rows.
+	"""
+
+	def __init__ (self, headers, sampleSize=None):
+		self.headers = headers
+		self.width = len (headers)
+		self.cache = classifiedunicodevalue.ClassifiedUnicodeValueCache ()
+		self.classifiers = None
+		if sampleSize:
+			self.classifiers = [classifiedunicodevalue.SampledClassifier
+				(self.cache, sampleSize) for header in headers]
+		self.distributions = [{} for header in headers]
+		self.encoders = [CompressedValueEncoder () for header in headers]
+		self.rowCount = 0
+
+	def addRow (self, row):
+		if len (row) < self.width:
+			row = list (row) + [None]*(self.width - len (row))
+		if self.classifiers:
+			for distribution, encoder, classifier, text in\
+				zip (self.distributions, self.encoders, self.classifiers, row):
+				value = classifier.value (text)
+				distribution [value] = distribution.get (value, 0) + 1
+				encoder.add (value)
+		else:
+			cache = self.cache
+			for distribution, encoder, text in\
+				zip (self.distributions, self.encoders, row):
+				value = cache.get (text).value
+				distribution [value] = distribution.get (value, 0) + 1
+				encoder.add (value)
+		self.rowCount += 1
+
+	def partial (self):
+		return (
+			self.distributions,
+			[encoder.close () for encoder in self.encoders],
+			self.rowCount
+		)
+
+	def merge (self, partial):
+		# Rows accumulated elsewhere, which must follow the rows already here
+		distributions, runLists, rowCount = partial
+		for distribution, encoder, partialDistribution, runs in\
+			zip (self.distributions, self.encoders, distributions, runLists):
+			for value, count in partialDistribution.iteritems ():
+				distribution [value] = distribution.get (value, 0) + count
+			encoder.addRuns (runs)
+		self.rowCount += rowCount
+
+	def toObject (self, origin, encodeData=False):
+		result = {
+			"origin": origin,
+			"code_lists": {},
+			"variable_sequence": self.headers,
+			"total_count": self.rowCount,
+			"variables": {},
+			"data": {}
+		}
+		variables = result ["variables"]
+		data = result ["data"]
+		for index, variableName in enumerate (self.headers):
+			cd = classifiedunicodevalue.ClassifiedDistribution\
+				(self.distributions [index])
+			if cd.dataType == "integer":
+				jsonType = "integer"
+			elif cd.dataType == "decimal":
+				jsonType = "decimal"
+			elif cd.dataType == "text":
+				jsonType = "string"
+			else:
+				jsonType = "null"
+			variables [variableName] = {
+				"sequence": index + 1,
+				"name": variableName,
+				"json_type": jsonType,
+				"distribution": cd.toObject (includeTotal=False)
+			}
+			runs = typedRuns (self.encoders [index].close (), jsonType)
+			if encodeData:
+				data [variableName] = encodedValues (valueIterator (runs), jsonType, cd)
+			else:
+				data [variableName] = runs
+		return result
+
+# Parallel parsing splits the data into byte ranges that each start a record.
+# Quote parity is tracked so that no range starts inside a quoted field, which
+# holds for well-formed CSV in single byte or UTF-8 encodings.
+
+def dataOffset (inputFilename, skipLines, quotechar='"'):
+	f = open (inputFilename, "rb")
+	inQuotes = False
+	records = 0
+	while records < skipLines:
+		line = f.readline ()
+		if not line: break
+		inQuotes ^= line.count (quotechar) % 2 == 1
+		if not inQuotes: records += 1
+	result = f.tell ()
+	f.close ()
+	return result
+
+def recordBoundaries (inputFilename, start, chunkSize, quotechar='"'):
+	f = open (inputFilename, "rb")
+	f.seek (start)
+	boundaries = [start]
+	position = start
+	target = start + chunkSize
+	inQuotes = False
+	while True:
+		block = f.read (2**20)
+		if not block: break
+		scanned = 0
+		while target < position + len (block):
+			newline = block.find ("\n", max (target - position, scanned))
+			if newline < 0: break
+			inQuotes ^= block.count (quotechar, scanned, newline) % 2 == 1
+			scanned = newline
+			target = position + newline + 1
+			if not inQuotes:
+				boundaries.append (target)
+				target += chunkSize
+		inQuotes ^= block.count (quotechar, scanned) % 2 == 1
+		position += len (block)
+	f.close ()
+	if position > boundaries [-1]:
+		boundaries.append (position)
+	return boundaries
+
+def accumulateChunk (args):
+	inputFilename, start, stop, headers, encoding, delimiter, sampleSize = args
+	f = open (inputFilename, "rb")
+	f.seek (start)
+	chunk = f.read (stop - start)
+	f.close ()
+	accumulator = ColumnAccumulator (headers, sampleSize)
+	for row in unicodecsv.UnicodeReader (cStringIO.StringIO (chunk),
+		encoding=encoding, delimiter=delimiter):
+		accumulator.addRow (row)
+	return accumulator.partial ()
+
 if __name__ == "__main__":
 
 	import getopt
 	import json
+	import multiprocessing
 	import os
 	import sys
-	import xlrd
 
-	optlist, args = getopt.getopt(sys.argv[1:], 'ad:h:s:e:o:w:')
+	multiprocessing.freeze_support ()
+
+	optlist, args = getopt.getopt(sys.argv[1:], 'ac:d:fh:p:s:e:o:w:z')
 
 	delimiter = ","
 	headerIndex = None
@@ -42,20 +193,33 @@ if __name__ == "__main__":
 	encoding = "cp1252"
 	outputPath = ""
 	worksheetName = None
+	encodeData = False
+	processes = 1
+	sampleSize = None
+	chunkSize = 2**26
 
 	for (option, value) in optlist:
+		if option == "-c":
+			# MB of the CSV file parsed by each process at a time with -p
+			chunkSize = int (value)*2**20
 		if option == "-d":
 			delimiter = value
 		if option == "-e":
 			encoding = value
+		if option == "-f":
+			sampleSize = 1000
 		if option == "-h":
 			headerIndex = int (value)
 		if option == "-o":
 			outputPath = value
+		if option == "-p":
+			processes = int (value)
 		if option == "-s":
 			skipLines = int (value)
 		if option == "-w":
 			worksheetName = value
+		if option == "-z":
+			encodeData = True
 
 	if skipLines is None:
 		if headerIndex is None:
@@ -64,7 +228,7 @@ if __name__ == "__main__":
 
 	if len (args) < 1 or\
 	   headerIndex > skipLines:
-		print "--Usage: [-d,] [-ecp1252] [-h1] [-s1] <inputFile> [<outputFile>]"
+		print "--Usage: [-d,] [-ecp1252] [-f] [-h1] [-s1] [-p1 [-c64]] [-z] <inputFile> [<outputFile>]"
 		sys.exit (0)
 
 	(root, csvExt) = os.path.splitext (args [0])
@@ -84,65 +248,80 @@ if __name__ == "__main__":
 		print "..Using line %d for headers" % headerIndex
 	if not (skipLines == 1 and headerIndex == 1):
 		print "..Taking data from line %d onwards" % skipLines
-	if worksheetName:
-		print "..Looking for worksheet '%s' in workbook %s" %\
-			(worksheetName, inputFilename)
-		wb = xlrd.open_workbook (inputFilename)
-		ws = wb.sheet_by_name (worksheetName)
-		print ws.ncols, ws.nrows
-		csvRows = [
-			[ws.cell_value (rowx, colx) for colx in xrange (ws.ncols)]
-			for rowx in xrange (ws.nrows)
-		]
-	else:
-		csvFile = open (inputFilename)
-		csv = unicodecsv.UnicodeReader (csvFile, encoding=encoding, delimiter=delimiter)
-		csvRows = list (csv)
+	def inputRows ():
+		if worksheetName:
+			print "..Looking for worksheet '%s' in workbook %s" %\
+				(worksheetName, inputFilename)
+			if csvExt.lower () in (".xlsx", ".xlsm"):
+				# Rows are parsed from the worksheet XML as they are needed
+				import openpyxl
+				wb = openpyxl.load_workbook (inputFilename, use_iterators=True)
+				ws = wb.get_sheet_by_name (worksheetName)
+				for row in ws.iter_rows ():
+					# Padding cells of sparse rows only have a value
+					yield [cell.value for cell in row]
+			else:
+				# xlrd loads the whole sheet; on_demand only leaves the
+				# other sheets of the workbook unread
+				import xlrd
+				wb = xlrd.open_workbook (inputFilename, on_demand=True)
+				ws = wb.sheet_by_name (worksheetName)
+				print ws.ncols, ws.nrows
+				for rowx in xrange (ws.nrows):
+					yield ws.row_values (rowx)
+				wb.release_resources ()
+		else:
+			csvFile = open (inputFilename)
+			csv = unicodecsv.UnicodeReader (csvFile, encoding=encoding, delimiter=delimiter)
+			for row in csv:
+				yield row
+			csvFile.close ()
+
+	accumulator = None
+	headers = None
+	lineCount = 0
+	if processes > 1 and headerIndex and not worksheetName:
+		print "..Parsing with %d processes" % processes
+		start = dataOffset (inputFilename, skipLines)
+		csvFile = open (inputFilename, "rb")
+		leadingRows = list (unicodecsv.UnicodeReader (
+			cStringIO.StringIO (csvFile.read (start)),
+			encoding=encoding, delimiter=delimiter))
 		csvFile.close ()
-	if skipLines > len (csvRows):
+		lineCount = len (leadingRows)
+		if lineCount >= headerIndex:
+			headers = leadingRows [headerIndex-1]
+			accumulator = ColumnAccumulator (headers, sampleSize)
+			boundaries = recordBoundaries (inputFilename, start, chunkSize)
+			pool = multiprocessing.Pool (processes)
+			for partial in pool.imap (accumulateChunk, [
+				(inputFilename, chunkStart, chunkStop, headers, encoding, delimiter, sampleSize)
+					for chunkStart, chunkStop in zip (boundaries [:-1], boundaries [1:])]):
+				accumulator.merge (partial)
+			pool.close ()
+			pool.join ()
+	else:
+		for lineCount, row in enumerate (inputRows (), 1):
+			if lineCount == headerIndex:
+				headers = row
+			if lineCount <= skipLines:
+				continue
+			if accumulator is None:
+				if headers is None:
+					headers = [u"V%d" % (index + 1) for index in xrange (len (row))]
+				accumulator = ColumnAccumulator (headers, sampleSize)
+			accumulator.addRow (row)
+	if skipLines > lineCount:
 		print "--Only %d row(s) found in CSV file, %d required for header" %\
-			(len (csvRows), skipLines)
+			(lineCount, skipLines)
 		sys.exit (0)
-	if headerIndex:
-		headers = csvRows [headerIndex-1]
-		csvRows = csvRows [skipLines:]
-	print "..%d row(s) found in input" % len (csvRows)
-
-	jsonObject = {
-		"origin": "csv2json %s from %s" % 
-			(savutilVersion, inputFilename),
-		"code_lists": {},
-		"variable_sequence": headers,
-		"total_count": len (csvRows),
-		"variables": {},
-		"data": {}
-	}
-	variables = jsonObject ["variables"]
-	data = jsonObject ["data"]
-	for index, variableName in enumerate (headers):
-		values = [ClassifiedUnicodeValue (row [index]).value for row in csvRows]
-		distribution = {}
-		for value in values:
-			if distribution.has_key (value):
-				distribution [value] += 1
-			else:
-				distribution [value] = 1
-		cd = classifiedunicodevalue.ClassifiedDistribution (distribution)
-		if cd.dataType == "integer":
-			jsonType = "integer"
-		elif cd.dataType == "decimal":
-			jsonType = "decimal"
-		elif cd.dataType == "text":
-			jsonType = "string"
-		else:
-			jsonType = "null"		
-		variables [variableName] = {
-			"sequence": index + 1,
-			"name": variableName,
-			"json_type": jsonType,
-			"distribution": cd.toObject (includeTotal=False)
-		}
-		data [variableName] = compressedValues (values, jsonType)
+	if accumulator is None:
+		accumulator = ColumnAccumulator (headers or [])
+	print "..%d row(s) found in input" % accumulator.rowCount
+
+	jsonObject = accumulator.toObject (
+		"csv2json %s from %s" % (savutilVersion, inputFilename),
+		encodeData)
 
 	jsonFile = open (outputFilename, 'wb')
 	json.dump (jsonObject, jsonFile,
@@ -0,0 +1,358 @@
+# datagen
+#
+# Generates synthetic survey datasets for scale testing, as .sav files and as
+# JSON files in the format written by sav2json -d. A dataset is described by a
+# shape specification (a dict, or a JSON file) and a seed:
+#
+#	{
+#		"cases": 100000,
+#		"title": "Scale test",
+#		"weight": true,
+#		"variables": [
+#			{"kind": "id"},
+#			{"kind": "categorical", "count": 500, "categories": 12, "skew": 1.2},
+#			{"kind": "integer", "count": 50, "min": 0, "max": 100},
+#			{"kind": "decimal", "count": 20, "mean": 50, "sd": 15, "dp": 2},
+#			{"kind": "text", "count": 5, "width": 400, "words": 60},
+#			{"kind": "date", "count": 3, "start": "2000-01-01", "end": "2015-12-31"},
+#			{"kind": "multresp", "count": 10, "items": 8, "p": 0.3}
+#		]
+#	}
+#
+# Every variable specification may also give a name prefix ("name") and the
+# proportion of missing values ("missing"). Categorical codes follow a Zipf
+# distribution with the given skew and are labelled.
+#
+# Each variable draws its values from its own random number generator, seeded
+# from the dataset seed and the variable's position, so the same seed gives
+# the same values whether the cases are written in case order (SAV) or variable
+# order (JSON), and neither output holds more than one case or one variable's
+# distribution in memory. The .sav file is written through the IBM SPSS I/O
+# module where it is available and by savwriter otherwise.
+#
+# As sav2json only records multiple response definitions against a variable
+# of the same name as the set, the sets are written to the SAV dictionary but
+# not to the JSON file.
+
+import bisect
+import datetime
+import exceptions
+import itertools
+import json
+import random
+import re
+import sys
+
+import classifiedunicodevalue
+import datautil
+import savdllwrapper
+import savwriter
+
+from version import savutilName, savutilVersion
+
+# Words of open-ended answers; some are non-ASCII to exercise UTF-8 handling,
+# though all are in cp1252, the default output encoding of json2sss
+vocabulary = u"""the a and of to in is that it was for on are with as be at one
+have this from or had by not but what all were we when your can said there use an
+each which she do how their if will up other about out many then them these so
+some her would make like him into time has look two more go see no way could people
+my than first been call who its now find long down day did get come made may part
+good service price quality staff friendly slow helpful expensive clean delivery
+caf\xe9 na\xefve r\xe9sum\xe9 \xfcber gro\xdf \xe5r \xf8l se\xf1or""".split ()
+
+formatRE = re.compile ("([A-Z]+)(\d+)(\.(\d+))?")
+
+# Distinct seeds for the variables of a dataset
+seedMultiplier = 1000003
+
+def isoDateOrdinal (isoText):
+	year, month, day = [int (part) for part in isoText.split ("-")]
+	return datetime.date (year, month, day).toordinal ()
+
+class GeneratedVariable:
+	"""
+	A variable of a generated dataset. values () yields the values of the
+	variable as sav2json would write them to JSON; savValue () converts one
+	to the value written to the .sav file.
+	"""
+
+	def __init__ (self, name, kind, spec, seed, nCases):
+		self.name = name
+		self.kind = kind
+		self.spec = spec
+		self.seed = seed
+		self.nCases = nCases
+		self.missing = spec.get ("missing", 0.0)
+		self.label = u"%s %s" % (kind.capitalize (), name)
+		self.valueLabels = {}
+		self.varType = 0
+		self.jsonType = "integer"
+		if kind in ("id", "integer"):
+			self.format = "F%d" % max (1, len (str (spec.get ("max", nCases))))
+		elif kind == "categorical":
+			categories = spec.get ("categories", 5)
+			skew = spec.get ("skew", 1.0)
+			self.format = "F%d" % len (str (categories))
+			self.valueLabels = dict ((code, u"Category %d" % code)
+				for code in xrange (1, categories + 1))
+			weights = [1.0/code**skew for code in xrange (1, categories + 1)]
+			total = sum (weights)
+			self.cumulative = []
+			cumulative = 0.0
+			for weight in weights:
+				cumulative += weight/total
+				self.cumulative.append (cumulative)
+		elif kind in ("decimal", "weight"):
+			self.dp = spec.get ("dp", 4 if kind == "weight" else 2)
+			self.format = "F%d.%d" % (spec.get ("width", 10), self.dp)
+			self.jsonType = "decimal"
+		elif kind == "text":
+			self.varType = spec.get ("width", 200)
+			self.format = "A%d" % self.varType
+			self.jsonType = "string"
+		elif kind == "date":
+			self.start = isoDateOrdinal (spec.get ("start", "2000-01-01"))
+			self.end = isoDateOrdinal (spec.get ("end", "2015-12-31"))
+			self.format = "DATE11"
+			self.jsonType = "date"
+		elif kind == "multresp":
+			self.format = "F1"
+			self.valueLabels = {1: u"Selected"}
+		else:
+			raise ValueError, "unknown variable kind '%s'" % kind
+
+	def values (self):
+		rng = random.Random (self.seed)
+		missing = self.missing
+		kind = self.kind
+		spec = self.spec
+		for case in xrange (self.nCases):
+			if missing and rng.random () < missing:
+				yield None
+			elif kind == "id":
+				yield case + 1
+			elif kind == "categorical":
+				yield bisect.bisect_left (self.cumulative, rng.random ()) + 1
+			elif kind == "integer":
+				yield rng.randint (spec.get ("min", 0), spec.get ("max", 100))
+			elif kind == "decimal":
+				yield round (rng.gauss (spec.get ("mean", 0.0), spec.get ("sd", 1.0)), self.dp)
+			elif kind == "weight":
+				yield round (rng.lognormvariate (0.0, spec.get ("sd", 0.5)), self.dp)
+			elif kind == "text":
+				yield self.text (rng)
+			elif kind == "date":
+				yield datetime.date.fromordinal (rng.randint (self.start, self.end)).isoformat ()
+			else:
+				yield 1 if rng.random () < spec.get ("p", 0.3) else None
+
+	def text (self, rng):
+		words = [rng.choice (vocabulary)
+			for index in xrange (rng.randint (1, self.spec.get ("words", 20)))]
+		text = u" ".join (words)
+		encoded = text.encode ("utf-8")
+		if len (encoded) > self.varType:
+			# Truncate to the width in bytes on a character boundary
+			text = encoded [:self.varType].decode ("utf-8", "ignore").rstrip ()
+		return text
+
+	def savValue (self, value):
+		if value is None:
+			return u"" if self.varType else None
+		if self.kind == "date":
+			return savdllwrapper.spssDate (value)
+		return value
+
+class GeneratedDataset:
+	def __init__ (self, spec, seed=0):
+		self.spec = spec
+		self.seed = seed
+		self.nCases = spec.get ("cases", 1000)
+		self.title = spec.get ("title", u"Synthetic dataset %d" % seed)
+		self.variables = []
+		self.multRespDefs = {}
+		specs = list (spec.get ("variables", []))
+		if spec.get ("weight"):
+			specs.append ({"kind": "weight", "name": "weight"})
+		counters = {}
+		for variableSpec in specs:
+			kind = variableSpec ["kind"]
+			prefix = variableSpec.get ("name", kind [:4])
+			for index in xrange (variableSpec.get ("count", 1)):
+				counters [prefix] = counters.get (prefix, 0) + 1
+				if kind == "multresp":
+					setName = "%s%d" % (prefix, counters [prefix])
+					varNames = ["%s_%d" % (setName, item + 1)
+						for item in xrange (variableSpec.get ("items", 5))]
+					for varName in varNames:
+						self.addVariable (varName, kind, variableSpec)
+					self.multRespDefs ["$" + setName] = {
+						"setType": "D",
+						"label": "Multiple response %s" % setName,
+						"countedValue": "1",
+						"varNames": varNames
+					}
+				elif kind in ("id", "weight") and variableSpec.get ("count", 1) == 1:
+					self.addVariable (prefix, kind, variableSpec)
+				else:
+					self.addVariable ("%s%d" % (prefix, counters [prefix]), kind, variableSpec)
+		self.varNames = [variable.name for variable in self.variables]
+		self.caseWeightVar = "weight" if spec.get ("weight") else None
+
+	def addVariable (self, name, kind, spec):
+		self.variables.append (GeneratedVariable (name, kind, spec,
+			self.seed*seedMultiplier + len (self.variables), self.nCases))
+
+	def records (self):
+		columns = [itertools.imap (variable.savValue, variable.values ())
+			for variable in self.variables]
+		return itertools.izip (*columns)
+
+	def writeSAV (self, savFilename, compressed=True):
+		dictionary = {
+			"varNames": self.varNames,
+			"varTypes": dict ((variable.name, variable.varType)
+				for variable in self.variables),
+			"varLabels": dict ((variable.name, variable.label)
+				for variable in self.variables),
+			"formats": dict ((variable.name, variable.format)
+				for variable in self.variables),
+			"valueLabels": dict ((variable.name, variable.valueLabels)
+				for variable in self.variables if variable.valueLabels),
+			"multRespDefs": self.multRespDefs,
+			"caseWeightVar": self.caseWeightVar,
+			"fileLabel": self.title
+		}
+		try:
+			writer = savdllwrapper.SavWriter (savFilename, ioUtf8=True,
+				**dictionary)
+		except OSError:
+			# The IBM SPSS I/O module could not be loaded
+			writer = savwriter.SavWriter (savFilename, compressed=compressed,
+				**dictionary)
+		with writer:
+			writer.writerows (self.records ())
+
+	# Writes the JSON file member by member. The variable data come before
+	# the variable metadata, so that each variable's distribution can be
+	# taken while its values are written.
+	def writeJSON (self, jsonFilename):
+		codeLists = {}
+		for variable in self.variables:
+			if variable.valueLabels:
+				table = dict ((unicode (code), label)
+					for code, label in variable.valueLabels.items ())
+				codeLists [variable.name] = {
+					"table": table,
+					"sequence": [unicode (code) for code in sorted (variable.valueLabels)]
+				}
+		header = {
+			"origin": "%s %s datagen seed %d" % (savutilName, savutilVersion, self.seed),
+			"application_format_namespace": "http://triple-s.org/savJSON",
+			"title": self.title,
+			"code_lists": codeLists,
+			"variable_sequence": self.varNames,
+			"total_count": self.nCases
+		}
+		if self.caseWeightVar:
+			header ["weight_variable"] = self.caseWeightVar
+		variableObjects = {}
+		with open (jsonFilename, "wb") as f:
+			f.write (json.dumps (header) [:-1])
+			f.write (', "data": {')
+			for index, variable in enumerate (self.variables):
+				if index:
+					f.write (", ")
+				f.write (json.dumps (variable.name) + ": ")
+				writer = datautil.JSONArrayWriter (f)
+				encoder = datautil.CompressedValueEncoder (writer.write, variable.jsonType)
+				distribution = {}
+				for value in variable.values ():
+					encoder.add (value)
+					distribution [value] = distribution.get (value, 0) + 1
+				encoder.close ()
+				writer.close ()
+				variableObjects [variable.name] = self.variableObject (variable,
+					index, distribution)
+			f.write ('}, "variables": ')
+			f.write (json.dumps (variableObjects))
+			f.write ("}\n")
+
+	def variableObject (self, variable, index, distribution):
+		cd = classifiedunicodevalue.ClassifiedDistribution (distribution)
+		result = {
+			"name": variable.name,
+			"title": variable.label,
+			"application_format": variable.format,
+			"distribution": cd.toObject (includeTotal=False),
+			"json_type": variable.jsonType,
+			"sequence": index + 1
+		}
+		result ["width"] = int (formatRE.match (variable.format).group (2))
+		if variable.valueLabels:
+			result ["code_list_name"] = variable.name
+			result ["incomplete_coding"] = False
+		return result
+
+def loadSpec (specFilename):
+	with open (specFilename) as f:
+		return json.load (f)
+
+if __name__ == "__main__":
+
+	import getopt
+	import os.path
+	import traceback
+
+	outputPath = "."
+	printVersion = False
+	seed = 0
+	outputSAV = False
+	outputJSON = False
+	uncompressed = False
+	optlist, args = getopt.getopt(sys.argv[1:], 'jo:r:suv')
+	for (option, value) in optlist:
+		if option == "-j":
+			outputJSON = True
+		if option == "-o":
+			outputPath = value
+		if option == "-r":
+			seed = int (value)
+		if option == "-s":
+			outputSAV = True
+		if option == "-u":
+			uncompressed = True
+		if option == "-v":
+			printVersion = True
+	if printVersion:
+		print "..datagen version %s" % savutilVersion
+	if len (args) == 0:
+		print "--No shape specification file specified"
+		sys.exit (0)
+	(root, specExt) = os.path.splitext (args [0])
+	if not specExt: specExt = ".json"
+	try:
+		dataset = GeneratedDataset (loadSpec (root + specExt), seed)
+	except exceptions.Exception, e:
+		print "--Can't load shape specification '%s': %s" % (root + specExt, e)
+		traceback.print_exc ()
+		sys.exit (0)
+	print "..%d record(s) in dataset" % dataset.nCases
+	print "..%d variable(s) in each record" % len (dataset.varNames)
+	name = "%s_%d" % (os.path.basename (root), seed)
+	if outputSAV:
+		try:
+			savFilename = os.path.join (outputPath, name + ".sav")
+			dataset.writeSAV (savFilename, compressed=not uncompressed)
+			print "..SAV file written to %s" % savFilename
+		except exceptions.Exception, e:
+			print "--Failed to write SAV file: %s" % e
+			traceback.print_exc ()
+	if outputJSON:
+		try:
+			jsonFilename = os.path.join (outputPath, name + ".json")
+			dataset.writeJSON (jsonFilename)
+			print "..JSON text written to %s" % jsonFilename
+		except exceptions.Exception, e:
+			print "--Failed to write JSON file: %s" % e
+			traceback.print_exc ()
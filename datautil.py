@@ -1,21 +1,31 @@
 # Tools to support JSON survey datasets
 
-import itertools
+import bisect
 import json
+import os.path
+import re
 	
 import classifiedunicodevalue
 from classifiedunicodevalue import ClassifiedUnicodeValue
 import unicodecsv
 from version import savutilName, savutilVersion
+
+try:
+	import numpy
+	numpyOk = True
+except ImportError:
+	numpyOk = False
 		
 # Use run length compression on a sequence of data values
 
-def compressedValueSequence (s, jsonType=None):
-	length = sum (1 for _ in s [1])
-	value = s [0]
+def typedValue (value, jsonType=None):
 	if value is not None:
 		if jsonType == "integer": value = int (value)
 		elif jsonType == "decimal": value = float (value)
+	return value
+
+def compressedRun (value, length, jsonType=None):
+	value = typedValue (value, jsonType)
 	if length == 1:
 		return value
 	else:
@@ -27,11 +37,211 @@ def compressedValueSequence (s, jsonType=None):
 				"v": value
 			}
 
+def compressedValueSequence (s, jsonType=None):
+	return compressedRun (s [0], sum (1 for _ in s [1]), jsonType)
+
+class _NoRun (object):
+	pass
+_noRun = _NoRun ()
+
+class CompressedValueEncoder (object):
+	"""
+	Incremental run length compression.
+
+	Values are added singly or in batches as they arrive, and each run is
+	passed to the sink (any callable, e.g. the write method of a
+	JSONArrayWriter) as soon as it is finished, so only the current run is
+	held. By default the runs are collected in the values list.
+	"""
+
+	def __init__ (self, sink=None, jsonType=None):
+		self.values = []
+		if sink is None:
+			sink = self.values.append
+		self.sink = sink
+		self.jsonType = jsonType
+		self.count = 0
+		self.runCount = 0
+		self.current = _noRun
+		self.length = 0
+
+	def add (self, value):
+		if value == self.current:
+			self.length += 1
+		else:
+			self.flush ()
+			self.current = value
+			self.length = 1
+
+	def extend (self, values):
+		current = self.current
+		length = self.length
+		for value in values:
+			if value == current:
+				length += 1
+			else:
+				self.length = length
+				self.flush ()
+				current = self.current = value
+				length = 1
+		self.length = length
+
+	def addRun (self, value, length):
+		if value == self.current:
+			self.length += length
+		elif length:
+			self.flush ()
+			self.current = value
+			self.length = length
+
+	def addRuns (self, runs):
+		# Runs compressed without typing, e.g. a segment of the same variable
+		for valueItem in runs:
+			self.addRun (runValue (valueItem), runLength (valueItem))
+
+	def flush (self):
+		if self.length:
+			self.sink (compressedRun (self.current, self.length, self.jsonType))
+			self.count += self.length
+			self.runCount += 1
+		self.current = _noRun
+		self.length = 0
+
+	def close (self):
+		self.flush ()
+		return self.values
+
 def compressedValues (values, jsonType=None):
-	return [compressedValueSequence (s, jsonType)
-		for s in itertools.groupby (values, lambda x: x)]
-	
-def valueIterator (values):
+	encoder = CompressedValueEncoder (jsonType=jsonType)
+	encoder.extend (values)
+	return encoder.close ()
+
+def typedRuns (runs, jsonType=None):
+	# Apply the typing of compressedRun to runs compressed before the
+	# variable's json_type was known
+	result = []
+	for valueItem in runs:
+		if type (valueItem) == dict:
+			if valueItem.get ("v") is not None:
+				valueItem ["v"] = typedValue (valueItem ["v"], jsonType)
+		else:
+			valueItem = typedValue (valueItem, jsonType)
+		result.append (valueItem)
+	return result
+
+class JSONArrayWriter (object):
+	"""
+	Writes a JSON array to a file one item at a time.
+	"""
+
+	def __init__ (self, f, **kwargs):
+		self.f = f
+		self.kwargs = kwargs
+		self.separator = ""
+		self.f.write ("[")
+
+	def write (self, item):
+		self.f.write (self.separator)
+		self.f.write (json.dumps (item, **self.kwargs))
+		self.separator = ","
+
+	def close (self):
+		self.f.write ("]")
+
+# Alternative encodings, chosen per variable from its classified distribution.
+# An encoded variable is an object whose "encoding" member names the
+# encoding, and whose runs are themselves run length compressed:
+#
+#	dictionary: {"encoding": "dictionary", "dictionary": [...], "codes": [...]}
+#		codes index the dictionary of distinct values in order of appearance
+#	delta: {"encoding": "delta", "deltas": [...]}
+#		each value is the sum of the deltas up to and including its own
+#	reference: {"encoding": "reference", "reference": r, "offsets": [...]}
+#		each value is r plus its offset (frame of reference)
+#
+# A variable left as a plain list is run length compressed as before.
+
+encodedRunsMember = {
+	"dictionary": "codes",
+	"delta": "deltas",
+	"reference": "offsets"
+}
+
+def chooseEncoding (cd, jsonType=None):
+	if cd is None or cd.frequencyType in ("empty", "constant"):
+		return "rle"
+	if jsonType == "integer":
+		if cd.frequencyType in ("id", "unique") and cd.missingFrequency == 0:
+			return "delta"
+		minimum = int (cd.minimumValue.value)
+		maximum = int (cd.maximumValue.value)
+		# Only worthwhile if at least two characters are saved on each value
+		if len (str (maximum - minimum)) + 1 < min (len (str (minimum)), len (str (maximum))):
+			return "reference"
+	elif jsonType not in ("decimal", "null") and cd.frequencyType == "variable":
+		if cd.uniqueValues*2 <= cd.nonMissingFrequency and\
+		   cd.minTextLength + 2 > len (str (cd.uniqueValues)):
+			return "dictionary"
+	return "rle"
+
+def encodedValues (values, jsonType=None, cd=None):
+	encoding = chooseEncoding (cd, jsonType)
+	if encoding == "dictionary":
+		dictionary = []
+		codeMap = {}
+		def code (value):
+			if value is None: return None
+			result = codeMap.get (value)
+			if result is None:
+				result = codeMap [value] = len (dictionary)
+				dictionary.append (typedValue (value, jsonType))
+			return result
+		codes = compressedValues (code (value) for value in values)
+		return {
+			"encoding": encoding,
+			"dictionary": dictionary,
+			"codes": codes
+		}
+	elif encoding == "delta":
+		# Unique values only have small deltas if they are in order, so the
+		# plain runs are kept too, and used if a value is out of order
+		deltaEncoder = CompressedValueEncoder ()
+		plainEncoder = CompressedValueEncoder (jsonType=jsonType)
+		previous = None
+		monotonic = True
+		for value in values:
+			plainEncoder.add (value)
+			value = int (value)
+			if previous is None:
+				deltaEncoder.add (value)
+			else:
+				if value < previous:
+					monotonic = False
+				deltaEncoder.add (value - previous)
+			previous = value
+		if not monotonic:
+			return plainEncoder.close ()
+		return {
+			"encoding": encoding,
+			"deltas": deltaEncoder.close ()
+		}
+	elif encoding == "reference":
+		reference = int (cd.minimumValue.value)
+		return {
+			"encoding": encoding,
+			"reference": reference,
+			"offsets": compressedValues (
+				None if value is None else int (value) - reference
+				for value in values)
+		}
+	return compressedValues (values, jsonType)
+
+def encodedRuns (values):
+	if type (values) == dict:
+		return values [encodedRunsMember [values ["encoding"]]]
+	return values
+
+def runValueIterator (values):
 	for valueItem in values:
 		if type (valueItem) == dict:
 			nulls = valueItem.get ("n")
@@ -44,3 +254,457 @@ def valueIterator (values):
 					yield value
 		else:
 			yield valueItem
+
+def valueIterator (values):
+	if type (values) != dict:
+		return runValueIterator (values)
+	return decodedValueIterator (values, runValueIterator (encodedRuns (values)))
+
+# Values of an encoded variable from its expanded runs, which need not come
+# from the runs member of values itself
+def decodedValueIterator (values, runs):
+	encoding = values ["encoding"]
+	if encoding == "dictionary":
+		dictionary = values ["dictionary"]
+		return (None if code is None else dictionary [code] for code in runs)
+	elif encoding == "delta":
+		return deltaValueIterator (runs)
+	elif encoding == "reference":
+		reference = values ["reference"]
+		return (None if offset is None else reference + offset for offset in runs)
+	raise ValueError, "unknown data encoding '%s'" % encoding
+
+def deltaValueIterator (deltas):
+	value = 0
+	for delta in deltas:
+		value += delta
+		yield value
+
+# Random access to run length compressed values
+
+def runLength (valueItem):
+	if type (valueItem) == dict:
+		nulls = valueItem.get ("n")
+		if nulls is not None:
+			return nulls
+		return valueItem.get ("r")
+	return 1
+
+def runValue (valueItem):
+	if type (valueItem) == dict:
+		return valueItem.get ("v")
+	return valueItem
+
+def runIndex (values):
+	"""
+	The index of a compressed value list is the list of cumulative case
+	counts at the end of each run, so that run k holds the cases from
+	index [k-1] up to but not including index [k]. For an encoded variable
+	the index is that of its compressed runs.
+	"""
+	result = []
+	total = 0
+	for valueItem in encodedRuns (values):
+		total += runLength (valueItem)
+		result.append (total)
+	return result
+
+class CompressedValueIndex (object):
+	"""
+	Random access to a run length compressed or encoded value list.
+
+	The run holding a case is found by bisection of the run index, which
+	is built from the values unless a stored index (e.g. from the
+	data_index member of a JSON dataset) is supplied.
+	"""
+
+	def __init__ (self, values, index=None):
+		self.values = values
+		self.runs = encodedRuns (values)
+		self.encoding = "rle"
+		if type (values) == dict:
+			self.encoding = values ["encoding"]
+		if index is None:
+			index = runIndex (values)
+		self.index = index
+		if self.encoding == "delta":
+			# Value preceding the first case of each run
+			self.bases = []
+			value = 0
+			for valueItem in self.runs:
+				self.bases.append (value)
+				value += runLength (valueItem)*runValue (valueItem)
+
+	def __len__ (self):
+		if len (self.index) == 0: return 0
+		return self.index [-1]
+
+	def runFor (self, i):
+		if i < 0: i += len (self)
+		if i < 0 or i >= len (self):
+			raise IndexError, "case index %d out of range" % i
+		return bisect.bisect_right (self.index, i)
+
+	def runStart (self, run):
+		if run == 0: return 0
+		return self.index [run - 1]
+
+	def runValues (self, run, offset, count):
+		value = runValue (self.runs [run])
+		if self.encoding == "delta":
+			base = self.bases [run]
+			return [base + (offset + n + 1)*value for n in xrange (count)]
+		if value is not None:
+			if self.encoding == "dictionary":
+				value = self.values ["dictionary"] [value]
+			elif self.encoding == "reference":
+				value += self.values ["reference"]
+		return [value]*count
+
+	def valueAt (self, i):
+		if i < 0: i += len (self)
+		run = self.runFor (i)
+		return self.runValues (run, i - self.runStart (run), 1) [0]
+
+	def slice (self, start, stop):
+		start, stop, step = slice (start, stop).indices (len (self))
+		result = []
+		if start >= stop: return result
+		run = self.runFor (start)
+		position = start
+		while position < stop:
+			runStop = min (self.index [run], stop)
+			result.extend (self.runValues (run,
+				position - self.runStart (run), runStop - position))
+			position = runStop
+			run += 1
+		return result
+
+# Expansion of compressed or encoded values into NumPy arrays. Numeric
+# variables become masked arrays with nulls masked, everything else an
+# object array, or optionally for strings a (codes, categories) pair with
+# null coded as -1.
+
+def runLists (runs):
+	# Run values and lengths in one pass, as toArray spends most of its
+	# time here for variables with many short runs
+	runValues = []
+	lengths = []
+	appendValue = runValues.append
+	appendLength = lengths.append
+	for valueItem in runs:
+		if type (valueItem) == dict:
+			nulls = valueItem.get ("n")
+			if nulls is None:
+				appendValue (valueItem ["v"])
+				appendLength (valueItem ["r"])
+			else:
+				appendValue (None)
+				appendLength (nulls)
+		else:
+			appendValue (valueItem)
+			appendLength (1)
+	return runValues, lengths
+
+def toArray (values, jsonType=None, categorical=False):
+	if not numpyOk:
+		raise ImportError ("toArray requires the numpy library")
+	encoding = "rle"
+	if type (values) == dict:
+		encoding = values ["encoding"]
+	runValues, lengths = runLists (encodedRuns (values))
+	lengths = numpy.array (lengths, dtype=numpy.int64)
+	if encoding == "delta":
+		return numpy.ma.array (numpy.cumsum (numpy.repeat (
+			numpy.array (runValues, dtype=numpy.int64), lengths)))
+	if encoding == "reference":
+		reference = values ["reference"]
+		runValues = [None if offset is None else reference + offset
+			for offset in runValues]
+	if categorical and jsonType not in ("integer", "decimal"):
+		if encoding == "dictionary":
+			categories = values ["dictionary"]
+			runCodes = [-1 if code is None else code for code in runValues]
+		else:
+			categories = []
+			codeMap = {}
+			runCodes = []
+			for value in runValues:
+				if value is None:
+					runCodes.append (-1)
+					continue
+				code = codeMap.get (value)
+				if code is None:
+					code = codeMap [value] = len (categories)
+					categories.append (value)
+				runCodes.append (code)
+		return (numpy.repeat (numpy.array (runCodes, dtype=numpy.int32), lengths),
+			categories)
+	if encoding == "dictionary":
+		dictionary = values ["dictionary"]
+		runValues = [None if runCode is None else dictionary [runCode]
+			for runCode in runValues]
+	if jsonType in ("integer", "decimal"):
+		if jsonType == "integer":
+			dtype = numpy.int64
+		else:
+			dtype = numpy.float64
+		nulls = numpy.array ([value is None for value in runValues], dtype=bool)
+		data = numpy.repeat (numpy.array (
+			[0 if value is None else value for value in runValues], dtype=dtype),
+			lengths)
+		if nulls.any ():
+			return numpy.ma.array (data, mask=numpy.repeat (nulls, lengths))
+		return numpy.ma.array (data)
+	objects = numpy.empty (len (runValues), dtype=object)
+	objects [:] = runValues
+	return numpy.repeat (objects, lengths)
+
+def toArrays (jsonData, variableNames=None, categorical=False):
+	if variableNames is None:
+		variableNames = jsonData ["variable_sequence"]
+	return dict ((variableName, toArray (
+			jsonData ["data"] [variableName],
+			jsonData ["variables"] [variableName] ["json_type"],
+			categorical))
+		for variableName in variableNames)
+
+# Loading the metadata of a JSON dataset without the data. A sidecar metadata
+# file (see metadataFilename) is used if it is at least as new as the dataset.
+# Otherwise the file is read a chunk at a time and the data members are
+# scanned past without being decoded (see _ChunkedJSON.skip).
+
+dataMembers = ("data", "data_index")
+
+def metadataFilename (jsonFilename):
+	root, ext = os.path.splitext (jsonFilename)
+	return root + "_meta" + (ext or ".json")
+
+def metadataObject (jsonData):
+	return dict ((key, value) for key, value in jsonData.items ()
+		if key not in dataMembers)
+
+_whitespaceRE = re.compile (r"[ \t\n\r]*")
+
+def loadMetadata (jsonFilename):
+	sidecar = metadataFilename (jsonFilename)
+	if os.path.exists (sidecar) and\
+	   os.path.getmtime (sidecar) >= os.path.getmtime (jsonFilename):
+		with open (sidecar) as f:
+			return json.load (f)
+	result = {}
+	with open (jsonFilename, "rb") as f:
+		reader = _ChunkedJSON (f, 0, 2**20)
+		for key in reader.members ():
+			if key in dataMembers:
+				reader.skip ()
+			else:
+				result [key] = reader.value ()
+	return result
+
+# Sequential access to the data of a JSON dataset without loading it. The
+# file is read a chunk at a time, and a value is decoded once the chunk holds
+# all of it.
+
+_delimiters = frozenset (",:]} \t\n\r")
+_structureRE = re.compile (r'["\[\]{}]')
+# Patterns for strings, and for arrays and objects that hold no brackets,
+# written so that they never backtrack
+_string = r'"[^"\\]*(?:\\.[^"\\]*)*"'
+# The rest of a string after its opening quote
+_stringRE = re.compile (_string [1:], re.DOTALL)
+_flatContainer = r'[\[{][^"\[\]{}]*(?:%s[^"\[\]{}]*)*[\]}]' % _string
+# Content within an array or object up to its next bracket, taking in
+# strings and flat arrays and objects, e.g. the runs of a variable
+_flatRE = re.compile (r'[^"\[\]{}]*(?:(?:%s|%s)[^"\[\]{}]*)*' % (_string, _flatContainer),
+	re.DOTALL)
+# Complete items of an array, each followed by a comma, which can be
+# decoded together
+_itemsRE = re.compile (r'(?:[ \t\n\r]*(?:[^"\[\]{}, \t\n\r]+|%s|%s)[ \t\n\r]*,)*' %
+	(_string, _flatContainer), re.DOTALL)
+
+class _ChunkedJSON (object):
+	def __init__ (self, f, position, chunkSize=2**16):
+		self.f = f
+		self.chunkSize = chunkSize
+		self.buffer = ""
+		self.offset = position	# File offset of the buffer
+		self.position = 0
+		self.start = None	# Start of a value being scanned, kept by fill
+		self.decoder = json.JSONDecoder ()
+
+	def tell (self):
+		return self.offset + self.position
+
+	def fill (self):
+		# The file may be shared, so each read seeks first
+		self.f.seek (self.offset + len (self.buffer))
+		data = self.f.read (self.chunkSize)
+		if not data:
+			return False
+		kept = self.position if self.start is None else self.start
+		if kept < len (self.buffer):
+			self.buffer = self.buffer [kept:] + data
+		else:
+			self.buffer = data
+		self.offset += kept
+		self.position -= kept
+		if self.start is not None:
+			self.start = 0
+		return True
+
+	def peek (self):
+		while True:
+			self.position = _whitespaceRE.match (self.buffer, self.position).end ()
+			if self.position < len (self.buffer) or not self.fill ():
+				return self.buffer [self.position:self.position + 1]
+
+	def expect (self, character):
+		if self.peek () != character:
+			raise ValueError ("expected '%s' at character %d" % (character, self.tell ()))
+		self.position += 1
+
+	def value (self):
+		if self.peek () in ("[", "{"):
+			# Arrays and objects are found by scanning, then decoded once
+			self.start = self.position
+			self.skip ()
+			value = self.decoder.decode (self.buffer [self.start:self.position])
+			self.start = None
+			return value
+		while True:
+			try:
+				value, end = self.decoder.raw_decode (self.buffer, self.position)
+				# A number cut by the end of the buffer, e.g. "12." of "12.5",
+				# decodes, but isn't followed by a delimiter
+				if self.buffer [end:end + 1] in _delimiters or not self.fill ():
+					self.position = end
+					return value
+			except ValueError:
+				if not self.fill ():
+					raise
+
+	def separated (self, closing):
+		# True until the closing bracket of an array or object is reached
+		character = self.peek ()
+		if character == closing:
+			self.position += 1
+			return False
+		if character == ",":
+			self.position += 1
+		return True
+
+	def items (self):
+		self.expect ("[")
+		while self.separated ("]"):
+			# The complete items in the buffer are decoded in one call,
+			# leaving the last, which may be cut by the end of the buffer
+			end = _itemsRE.match (self.buffer, self.position).end ()
+			if end > self.position:
+				batch = self.decoder.decode ("[%s]" % self.buffer [self.position:end - 1])
+				self.position = end - 1
+				for value in batch:
+					yield value
+			else:
+				yield self.value ()
+
+	def members (self):
+		# Yields the key of each member, after which the caller reads its value
+		self.expect ("{")
+		while self.separated ("}"):
+			key = self.value ()
+			self.expect (":")
+			yield key
+
+	def skip (self):
+		# Arrays and objects are skipped by scanning for their closing
+		# bracket, outside strings, without decoding their contents
+		if self.peek () not in ("[", "{"):
+			self.value ()
+			return
+		depth = 0
+		while True:
+			if depth:
+				self.position = _flatRE.match (self.buffer, self.position).end ()
+			match = _structureRE.search (self.buffer, self.position)
+			if match is None:
+				self.position = len (self.buffer)
+				if not self.fill ():
+					raise ValueError ("unterminated array or object at character %d" % self.tell ())
+				continue
+			self.position = match.end ()
+			character = match.group ()
+			if character == '"':
+				end = _stringRE.match (self.buffer, self.position)
+				while end is None:
+					if not self.fill ():
+						raise ValueError ("unterminated string at character %d" % self.tell ())
+					end = _stringRE.match (self.buffer, self.position)
+				self.position = end.end ()
+			elif character in "[{":
+				depth += 1
+			else:
+				depth -= 1
+				if depth == 0:
+					return
+
+class JSONDataFile (object):
+	"""
+	The metadata of a JSON dataset, and its data one variable at a time.
+
+	A first pass decodes the metadata and notes the file offset of the runs
+	of each variable, scanning past the data without decoding it, in chunks
+	of scanChunkSize bytes. Each valueIterator then reads its variable's runs
+	from the file chunkSize bytes at a time through a shared file handle, so
+	that many variables can be read side by side, e.g. to rebuild cases, with
+	one chunk in memory for each.
+	"""
+
+	def __init__ (self, jsonFilename, chunkSize=2**16, scanChunkSize=2**20):
+		self.f = open (jsonFilename, "rb")
+		self.chunkSize = chunkSize
+		self.metadata = {}
+		self.sources = {}
+		reader = _ChunkedJSON (self.f, 0, scanChunkSize)
+		for key in reader.members ():
+			if key == "data":
+				for name in reader.members ():
+					self.sources [name] = self.source (reader)
+			elif key in dataMembers:
+				reader.skip ()
+			else:
+				self.metadata [key] = reader.value ()
+
+	def source (self, reader):
+		# The offset of the runs, with the other members of an encoded variable
+		if reader.peek () == "[":
+			source = {"offset": reader.tell ()}
+			reader.skip ()
+			return source
+		source = {}
+		for key in reader.members ():
+			if key in encodedRunsMember.values ():
+				source ["offset"] = reader.tell ()
+				reader.skip ()
+			else:
+				source [key] = reader.value ()
+		return source
+
+	def hasData (self):
+		return len (self.sources) > 0
+
+	def valueIterator (self, name):
+		source = self.sources [name]
+		runs = _ChunkedJSON (self.f, source ["offset"], self.chunkSize).items ()
+		if source.get ("encoding") is None:
+			return runValueIterator (runs)
+		return decodedValueIterator (source, runValueIterator (runs))
+
+	def close (self):
+		self.f.close ()
+
+	def __enter__ (self):
+		return self
+
+	def __exit__ (self, type, value, tb):
+		self.close ()
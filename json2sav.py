@@ -0,0 +1,203 @@
+# json2sav
+#
+# Converts a JSON dataset created by sav2json (with case data, i.e. sav2json -d) or
+# csv2json back into a .sav file, through the IBM SPSS I/O module used by sav2json.
+# The variables, titles, formats, code lists and weight variable become the SAV
+# dictionary; variables without a format (as from csv2json) are written as strings
+# or F8.2 numbers by their json_type. The JSON file is read with
+# datautil.JSONDataFile, which decodes the metadata and then the run length
+# compressed data of all the variables side by side, a chunk of the file at a time.
+# The cases are expanded and written a batch at a time, so neither the data nor the
+# cases are held in memory beyond one batch.
+#
+# sav2json writes user missing values as nulls, so they return as system missing
+# values (blank for string variables); the JSON does not record the original
+# missing value definitions.
+#
+# Where the IBM SPSS I/O module is not available, the -p switch writes the file
+# with the pure Python writer in savwriter.
+
+import exceptions
+import itertools
+import os.path
+import re
+import sys
+
+import datautil
+import savdllwrapper
+import savwriter
+
+from version import savutilVersion
+
+formatRE = re.compile ("([A-Z]+)(\d+)(\.(\d+))?")
+
+# Values of string variables; numeric values, e.g. of a string variable
+# that only contained digits, are written as their text
+def stringColumn (values):
+	return [u"" if value is None else unicode (value) for value in values]
+
+def dateColumn (values):
+	return map (savdllwrapper.spssDate, values)
+
+def durationColumn (values):
+	return map (savdllwrapper.ISODurationSeconds, values)
+
+class JSONVariable:
+	def __init__ (self, name, variableObject, codeLists):
+		self.name = name
+		self.label = variableObject.get ("title") or u""
+		self.format = variableObject.get ("application_format")
+		self.multRespDef = variableObject.get ("spss_multiple_response_definition")
+		# csv2json gives no application_format, only the json_type
+		parsedFormat = formatRE.match (self.format or "")
+		bareFormat = parsedFormat.group (1) if parsedFormat else None
+		if bareFormat == "A" or (bareFormat is None and
+			variableObject.get ("json_type") == "string"):
+			self.varType = variableObject.get ("width")
+			if not self.varType and parsedFormat:
+				self.varType = int (parsedFormat.group (2))
+			if not self.varType:
+				# At most three bytes per character in UTF-8
+				maxLength = variableObject.get ("distribution", {}).get ("max_text_length")
+				self.varType = max (1, 3*(maxLength or 1))
+			if not parsedFormat:
+				self.format = "A%d" % self.varType
+			self.convert = stringColumn
+		else:
+			self.varType = 0
+			if not parsedFormat:
+				self.format = "F8.2"
+			if bareFormat in savdllwrapper.supportedDates:
+				self.convert = dateColumn
+			elif bareFormat == "DTIME":
+				self.convert = durationColumn
+			else:
+				self.convert = None
+		self.valueLabels = {}
+		codeList = codeLists.get (variableObject.get ("code_list_name"))
+		if codeList:
+			for code, label in codeList ["table"].items ():
+				if self.varType == 0:
+					try:
+						code = float (code)
+					except ValueError:
+						continue
+				self.valueLabels [code] = label
+
+class JSONDataset:
+	"""
+	A JSON dataset to be written as a .sav file. jsonData is the dataset,
+	or only its metadata if valueIterator is given: a function returning an
+	iterator over the values of the named variable, such as the valueIterator
+	method of a datautil.JSONDataFile.
+	"""
+
+	def __init__ (self, jsonData, valueIterator=None):
+		self.jsonData = jsonData
+		if valueIterator is None:
+			data = jsonData.get ("data")
+			if data is not None:
+				valueIterator = lambda name: datautil.valueIterator (data [name])
+		self.valueIterator = valueIterator
+		self.nCases = jsonData ["total_count"]
+		self.varNames = jsonData ["variable_sequence"]
+		codeLists = jsonData.get ("code_lists", {})
+		self.variables = [JSONVariable (name, jsonData ["variables"] [name], codeLists)
+			for name in self.varNames]
+
+	# Keyword arguments of SavWriter for the SAV dictionary
+	def dictionary (self):
+		result = {
+			"varNames": self.varNames,
+			"varTypes": dict ((variable.name, variable.varType)
+				for variable in self.variables),
+			"varLabels": dict ((variable.name, variable.label)
+				for variable in self.variables),
+			"formats": dict ((variable.name, variable.format)
+				for variable in self.variables),
+			"valueLabels": dict ((variable.name, variable.valueLabels)
+				for variable in self.variables if variable.valueLabels)
+		}
+		multRespDefs = dict ((variable.name, variable.multRespDef)
+			for variable in self.variables if variable.multRespDef)
+		if multRespDefs:
+			result ["multRespDefs"] = multRespDefs
+		if self.jsonData.get ("weight_variable"):
+			result ["caseWeightVar"] = self.jsonData ["weight_variable"]
+		if self.jsonData.get ("title"):
+			result ["fileLabel"] = self.jsonData ["title"]
+		return result
+
+	# Batches of cases as dicts of columns keyed by variable name, for
+	# SavWriter.writerows in UTF-8 mode
+	def columnBatches (self, batchSize=10000):
+		if self.valueIterator is None:
+			raise ValueError, "the JSON file has no case data (use sav2json -d)"
+		iterators = [self.valueIterator (variable.name)
+			for variable in self.variables]
+		for start in xrange (0, self.nCases, batchSize):
+			count = min (batchSize, self.nCases - start)
+			batch = {}
+			for variable, values in zip (self.variables, iterators):
+				column = list (itertools.islice (values, count))
+				if variable.convert:
+					column = variable.convert (column)
+				batch [variable.name.encode ("utf-8")] = column
+			yield batch
+
+	def writeSAV (self, savFilename, batchSize=10000, overwrite=False, pure=False):
+		if os.path.exists (savFilename) and not overwrite:
+			raise IOError, "file %s already exists" % savFilename
+		if pure:
+			writer = savwriter.SavWriter (savFilename, **self.dictionary ())
+		else:
+			writer = savdllwrapper.SavWriter (savFilename, ioUtf8=True,
+				**self.dictionary ())
+		with writer:
+			for batch in self.columnBatches (batchSize):
+				writer.writerows (batch)
+
+if __name__ == "__main__":
+
+	import getopt
+	import traceback
+
+	outputPath = "."
+	printVersion = False
+	overwrite = False
+	pure = False
+	optlist, args = getopt.getopt(sys.argv[1:], 'o:pvw')
+	for (option, value) in optlist:
+		if option == "-o":
+			outputPath = value
+		if option == "-p":
+			pure = True
+		if option == "-v":
+			printVersion = True
+		if option == "-w":
+			overwrite = True
+	if printVersion:
+		print "..json2sav version %s" % savutilVersion
+	if len (args) == 0:
+		print "--No JSON file specified"
+		sys.exit (0)
+	(root, jsonExt) = os.path.splitext (args [0])
+	if not jsonExt: jsonExt = ".json"
+	try:
+		dataFile = datautil.JSONDataFile (root + jsonExt)
+		dataset = JSONDataset (dataFile.metadata,
+			dataFile.valueIterator if dataFile.hasData () else None)
+	except exceptions.Exception, e:
+		print "--Can't load JSON file '%s': %s" % (root + jsonExt, e)
+		traceback.print_exc ()
+		sys.exit (0)
+	print "..%d record(s) in JSON file" % dataset.nCases
+	print "..%d variable(s) in each record" % len (dataset.varNames)
+	try:
+		savFilename = os.path.join (outputPath, os.path.basename (root) + ".sav")
+		dataset.writeSAV (savFilename, overwrite=overwrite, pure=pure)
+		print "..SAV file written to %s" % savFilename
+	except exceptions.Exception, e:
+		print "--Failed to write SAV file: %s" % e
+		traceback.print_exc ()
+	dataFile.close ()
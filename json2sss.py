@@ -9,6 +9,11 @@ from xml.sax.saxutils import escape, quoteattr
 import datautil
 import unicodecsv
 
+# Encoding of the XML and data files; set by the -e switch
+outputEncoding = "Windows-1252"
+# Round up string widths; cleared by the -s switch
+sensibleStringLengths = True
+
 def isPowerOfTen (x):
 	if x == 0 or x != int(x): return False
 	x = abs (x)
@@ -210,6 +215,51 @@ def writeXMLForVariables (jsonData, XMLFile, format="asc"):
 			XMLFile.write ("""				</values>\n""")
 		XMLFile.write ("""			</variable>\n""")
 
+# The data file, after SSSAllocate. We can't use the bare data values because
+# we have to reformat time/date and justify fixed-format fields
+def writeData (jsonData, datafile, format="asc"):
+	if format == "csv":
+		CSVFile = unicodecsv.writer (datafile, encoding=outputEncoding,
+			buffer_size=2**20)
+		CSVFile.writerow (jsonData ["variable_sequence"])
+	fieldData = [(
+		datautil.valueIterator (jsonData ["data"] [variableName]),
+		jsonData ["variables"] [variableName] ["SSSType"],
+		jsonData ["variables"] [variableName] ["SSSWidth"],
+		jsonData ["variables"] [variableName] .get ("SSSFormat"),
+		jsonData ["variables"] [variableName] .get ("SSSNumericFormat")
+	) for variableName in jsonData ["variable_sequence"]]
+	for sequence in xrange (jsonData ["total_count"]):
+		record = []
+		for index, (rawValue, variableType, width, numLit, numericFormat)\
+			in enumerate (fieldData):
+			value = rawValue.next ()
+			if value is None:
+				value = u""
+			else:
+				if variableType == "quantity" or\
+				   (variableType == "single" and numLit == "numeric"):
+					value = numericFormat % value
+				elif variableType == "date":
+					value = value [:4] + value [5:7] + value [8:]
+				elif variableType == "time":
+					value = value [:2] + value [3:5] + value [6:]
+			if format == "asc":
+				if variableType == "character" or\
+				   (variableType == "single" and numLit == "literal"):
+					value = unicode (value).ljust (width)
+				else:
+					value = unicode (value).rjust (width)
+			else:
+				value = unicode (value).strip ()
+			record.append (value)
+		if format == "csv":
+			CSVFile.writerow (record)
+		else:
+			datafile.write (forceEncoding(u"".join (record).rstrip () + u"\n"))				
+	if format == "csv":
+		CSVFile.flush ()
+
 if __name__ == "__main__":
 	import datetime
 	import getopt
@@ -375,47 +425,8 @@ if __name__ == "__main__":
 		outputXMLFile.close ()
 		
 		outputDataFilename = root + "_sss" + extension
-		# We can't use the bare data values because we have to reformat time/date and
-		# justify fixed-format fields
 		datafile = open (outputDataFilename, "wb")
-		if format == "csv":
-			CSVFile = unicodecsv.writer (datafile, encoding=outputEncoding)
-			CSVFile.writerow (jsonData ["variable_sequence"])
-		fieldData = [(
-			datautil.valueIterator (jsonData ["data"] [variableName]),
-			jsonData ["variables"] [variableName] ["SSSType"],
-			jsonData ["variables"] [variableName] ["SSSWidth"],
-			jsonData ["variables"] [variableName] .get ("SSSFormat"),
-			jsonData ["variables"] [variableName] .get ("SSSNumericFormat")
-		) for variableName in jsonData ["variable_sequence"]]
-		for sequence in xrange (jsonData ["total_count"]):
-			record = []
-			for index, (rawValue, variableType, width, numLit, numericFormat)\
-				in enumerate (fieldData):
-				value = rawValue.next ()
-				if value is None:
-					value = u""
-				else:
-					if variableType == "quantity" or\
-					   (variableType == "single" and numLit == "numeric"):
-						value = numericFormat % value
-					elif variableType == "date":
-						value = value [:4] + value [5:7] + value [8:]
-					elif variableType == "time":
-						value = value [:2] + value [3:5] + value [6:]
-				if format == "asc":
-					if variableType == "character" or\
-					   (variableType == "single" and numLit == "literal"):
-						value = unicode (value).ljust (width)
-					else:
-						value = unicode (value).rjust (width)
-				else:
-					value = unicode (value).strip ()
-				record.append (value)
-			if format == "csv":
-				CSVFile.writerow (record)
-			else:
-				datafile.write (forceEncoding(u"".join (record).rstrip () + u"\n"))				
+		writeData (jsonData, datafile, format)
 		datafile.close ()
 		
 	except UnicodeEncodeError, e:
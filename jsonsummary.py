@@ -3,6 +3,8 @@ import os
 
 import openpyxl
 
+import datautil
+
 class EnhancementWorkbookError (exceptions.Exception):
 	pass
 	
@@ -10,12 +12,14 @@ class EnhancementWorkbook (object):
 	def __init__ (self, workbookFilename, mode="readonly"):
 		self.workbookFilename = workbookFilename
 		self.mode = mode
-		if mode == "new":
+		if mode in ("new", "stream"):
 			if os.path.exists (workbookFilename):
 				raise EnhancementWorkbookError,\
 					"Can't open workbook: '%s' already exists" %\
 						workbookFilename
-			self.wb = openpyxl.Workbook ()
+			# A streamed workbook is write-only: rows are written out as they
+			# are appended, in order, and cells can't be revisited
+			self.wb = openpyxl.Workbook (optimized_write=(mode == "stream"))
 		else:
 			self.wb = openpyxl.load_workbook (workbookFilename)
 			
@@ -24,7 +28,7 @@ class EnhancementWorkbook (object):
 			raise EnhancementWorkbookError,\
 				"Can't save read-only workbook: '%s'" %\
 					self.workbookFilename
-		elif self.mode == "new":
+		elif self.mode in ("new", "stream"):
 			if os.path.exists (self.workbookFilename):
 				raise EnhancementWorkbookError,\
 					"Can't save new workbook: '%s' already exists" %\
@@ -34,7 +38,6 @@ class EnhancementWorkbook (object):
 if __name__ == "__main__":
 
 	import getopt
-	import json
 	import sys
 	import traceback
 
@@ -52,9 +55,7 @@ if __name__ == "__main__":
 		
 	# Get JSON information
 	try:
-		jsonFile = open (root + jsonExt)
-		jsonData = json.loads (jsonFile.read ())
-		jsonFile.close ()
+		jsonData = datautil.loadMetadata (root + jsonExt)
 	except exceptions.Exception, e:
 		print "--Can't load JSON file (%s)" % e
 		traceback.print_exc ()
@@ -72,18 +73,15 @@ if __name__ == "__main__":
 		workRoot = root
 		workExt = ".xlsx"
 	try:
-		ewb = EnhancementWorkbook (workRoot + workExt, "new")
+		ewb = EnhancementWorkbook (workRoot + workExt, "stream")
 	except exceptions.Exception, e:
 		print "--Error: %s" % e
 		sys.exit (0)
 		
 	wb = ewb.wb
-	distributions = wb.active
-	distributions.title = "Input Distributions"
-	wb.create_sheet (0, title="Input Lists")
-	lists = wb.active
-	wb.create_sheet (0, title="Input Map")
-	map = wb.active
+	map = wb.create_sheet (title="Input Map")
+	lists = wb.create_sheet (title="Input Lists")
+	distributions = wb.create_sheet (title="Input Distributions")
 
 	map.append ((
 		'Name',
@@ -129,17 +127,17 @@ if __name__ == "__main__":
 				lists.append ((codeListName, outputCode, table [code]))
 
 	distributions.append (("Name", "Frequency", "Measure", "Value", "Label"))
-	distributions.append (("", totalCount, "All records"))
+	distributions.append ((None, totalCount, "All records"))
 	variableSequence = jsonData ["variable_sequence"]
 	emptyList = {}
 	for variableName in variableSequence:
+		variable = jsonData ["variables"] [variableName]
 		listName = variable.get ("code_list_name")
 		if listName:
 			listObject = jsonData ["code_lists"].get (listName)
 			listTable = listObject ["table"]
 		else:
 			listTable = emptyList
-		variable = jsonData ["variables"] [variableName]
 		jsonType = variable ["json_type"]
 		distribution = variable ["distribution"]
 		distributions.append ((
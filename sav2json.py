@@ -12,6 +12,7 @@
 
 import exceptions
 import io
+import json
 import math
 import re
 import sys
@@ -135,11 +136,14 @@ class SAVDataset:
 		savFilename,
 		sensibleStringLengths=True,
 		tempMemory=2**26,
-		windowedValues=2**20):
+		windowedValues=2**20,
+		sampleSize=None):
 		self.savFilename = savFilename
 		self.tempFile = tempfile.SpooledTemporaryFile (tempMemory)
-		self.tempCSVWriter = unicodecsv.writer (self.tempFile, encoding="utf-8")
+		self.tempCSVWriter = unicodecsv.writer (self.tempFile, encoding="utf-8",
+			buffer_size=2**20)
 		self.cache = classifiedunicodevalue.ClassifiedUnicodeValueCache ()
+		self.sampleSize = sampleSize
 		self.sensibleStringLengths = sensibleStringLengths
 		with savdllwrapper.SavHeaderReader(savFilename, ioUtf8=True) as spssDict:
 			dictionary = spssDict.dataDictionary()
@@ -237,19 +241,33 @@ class SAVDataset:
 			self.tempFile.seek (0)
 			reader = unicodecsv.reader (self.tempFile, encoding="utf-8")
 			self.windowStart = index
-			self.windowedRecords = [
-					record [index:min (index + self.windowedVariables, self.numVars)]
-				for record in reader]
-		return (noneBlank (windowedRecord [index - self.windowStart]) for
+			self.windowedRecords = []
+			# Blank values are spilled as empty cells, so the reader maps
+			# them to None rather than noneBlank
+			for block in reader.iter_blocks (
+				columns=slice (index, min (index + self.windowedVariables, self.numVars)),
+				empty_as_none=True):
+				self.windowedRecords.extend (block)
+		return (windowedRecord [index - self.windowStart] for
 			windowedRecord in self.windowedRecords)
 
 	def writeCSV (self, writer, header=False, interpretCodes=False):
-		def formattedCell (col, index):
-			return formatDP (self.cache.get (omitMissing (
-				col,
-				self.missingValuesList [index])).value,
-				self.dpList [index]
-			)
+		if self.sampleSize:
+			classifiers = [classifiedunicodevalue.SampledClassifier
+				(self.cache, self.sampleSize) for variable in self.variables]
+			def formattedCell (col, index):
+				return formatDP (classifiers [index].value (omitMissing (
+					col,
+					self.missingValuesList [index])),
+					self.dpList [index]
+				)
+		else:
+			def formattedCell (col, index):
+				return formatDP (self.cache.get (omitMissing (
+					col,
+					self.missingValuesList [index])).value,
+					self.dpList [index]
+				)
 		def interpretedCell (value, codeList):
 			if codeList and codeList.get (value):
 				return codeList [value]
@@ -263,17 +281,17 @@ class SAVDataset:
 			else:
 				codeList = None
 			codeListList.append (codeList)
-		for caseIndex, record in enumerate (self.reader):
-			outputRecord = [
+		writer.writerows ([
 					interpretedCell (formattedCell (
 						record [index], index
 					),
 					codeListList [index])
 					for index, col in enumerate (record)
-			]
-			writer.writerow (outputRecord)
+			] for record in self.reader)
+		writer.flush ()
 	
-	def toObject (self, includeValues=False):
+	def toObject (self, includeValues=False, includeData=False, encodeData=False,
+		includeIndex=False):
 		result = {
 			"origin": "sav2json %s from %s" % 
 				(savutilVersion, self.SPSSVersion),
@@ -327,14 +345,65 @@ class SAVDataset:
 		if includeData:
 			result ["data"] = {}
 			for index, variable in enumerate (self.variables):
-				result ["data"] [variable.name] = datautil.compressedValues\
-					(self.variableValues (index), variable.jsonType)
+				if encodeData:
+					result ["data"] [variable.name] = datautil.encodedValues\
+						(self.variableValues (index), variable.jsonType, variable.cd)
+				else:
+					result ["data"] [variable.name] = datautil.compressedValues\
+						(self.variableValues (index), variable.jsonType)
+			if includeIndex:
+				result ["data_index"] = {}
+				for name, values in result ["data"].items ():
+					result ["data_index"] [name] = datautil.runIndex (values)
 		return result
+
+	# Writes the JSON text, with the data of one variable at a time. The runs
+	# of run length compressed data are written as they are finished, so the
+	# compressed data of a variable isn't held either.
+	def writeJSON (self, f, includeData=False, encodeData=False, includeIndex=False):
+		jsonObject = self.toObject ()
+		text = json.dumps (jsonObject)
+		if not includeData:
+			print >>f, text
+			return jsonObject
+		f.write (text [:-1])
+		f.write (', "data": {')
+		dataIndex = {}
+		for index, variable in enumerate (self.variables):
+			if index:
+				f.write (", ")
+			f.write (json.dumps (variable.name))
+			f.write (": ")
+			if encodeData:
+				values = datautil.encodedValues (self.variableValues (index),
+					variable.jsonType, variable.cd)
+				f.write (json.dumps (values))
+				if includeIndex:
+					dataIndex [variable.name] = datautil.runIndex (values)
+				continue
+			writer = datautil.JSONArrayWriter (f)
+			if includeIndex:
+				runIndex = dataIndex [variable.name] = []
+				def sink (valueItem):
+					writer.write (valueItem)
+					runIndex.append ((runIndex [-1] if runIndex else 0) +
+						datautil.runLength (valueItem))
+			else:
+				sink = writer.write
+			encoder = datautil.CompressedValueEncoder (sink, variable.jsonType)
+			encoder.extend (self.variableValues (index))
+			encoder.close ()
+			writer.close ()
+		f.write ("}")
+		if includeIndex:
+			f.write (', "data_index": ')
+			f.write (json.dumps (dataIndex))
+		f.write ("}\n")
+		return jsonObject
 			
 if __name__ == "__main__":
 
 	import getopt
-	import json
 	import os.path
 	import sys
 	import traceback
@@ -348,8 +417,12 @@ if __name__ == "__main__":
 	header = False
 	interpretCodes = False
 	includeData = False
+	sampleSize = None
+	includeIndex = False
+	outputMetadata = False
+	encodeData = False
 	pretty = False
-	optlist, args = getopt.getopt(sys.argv[1:], 'cde:hijo:ptv')
+	optlist, args = getopt.getopt(sys.argv[1:], 'cde:fhijmo:ptvxz')
 	for (option, value) in optlist:
 		if option == '-c':
 			outputCSV = True
@@ -357,12 +430,16 @@ if __name__ == "__main__":
 			includeData = True
 		if option == "-e":
 			outputEncoding = value
+		if option == "-f":
+			sampleSize = 1000
 		if option == "-h":
 			header = True
 		if option == "-i":
 			interpretCodes = True
 		if option == '-j':
 			outputJSON = True
+		if option == "-m":
+			outputMetadata = True
 		if option == "-o":
 			outputPath = value
 		if option == "-p":
@@ -371,13 +448,17 @@ if __name__ == "__main__":
 			outputText = True
 		if option == "-v":
 			printVersion = True
+		if option == "-x":
+			includeIndex = True
+		if option == "-z":
+			encodeData = True
 	if printVersion:
 		print "..sav2json version %s" % savutilVersion
 	if len (args) > 0:	
 		(root, savExt) = os.path.splitext (args [0])
 		if not savExt: savExt = ".sav"
 		try:
-			dataset = SAVDataset (root + savExt)
+			dataset = SAVDataset (root + savExt, sampleSize=sampleSize)
 		except exceptions.Exception, e:
 			print "--Cannot load SAV file '%s': %s" %\
 				(root + savExt, e)
@@ -403,7 +484,8 @@ if __name__ == "__main__":
 		try:
 			CSVFilename = os.path.join (outputPath, root + ".csv")
 			f = open (CSVFilename, "wb")
-			writer = unicodecsv.writer (f, encoding=outputEncoding)
+			writer = unicodecsv.writer (f, encoding=outputEncoding,
+				buffer_size=2**20)
 			dataset.writeCSV (writer, header, interpretCodes)
 			print "..CSV data written to %s" % f.name
 			f.close ()
@@ -416,15 +498,24 @@ if __name__ == "__main__":
 			JSONFilename = os.path.join (outputPath, root + ".json")
 			f = open (JSONFilename, "wb")
 			if pretty:
-				print >>f, json.dumps (dataset.toObject (),
+				# Sorted and indented text needs the whole object
+				jsonObject = dataset.toObject (includeData=includeData,
+					encodeData=encodeData, includeIndex=includeIndex)
+				print >>f, json.dumps (jsonObject,
 					sort_keys=True,
 					indent=4,
 					separators=(',', ': ')
 					)
 			else:
-				print >>f, json.dumps (dataset.toObject ())
+				jsonObject = dataset.writeJSON (f, includeData=includeData,
+					encodeData=encodeData, includeIndex=includeIndex)
 			print "..JSON text written to %s" % f.name
 			f.close ()
+			if outputMetadata:
+				f = open (datautil.metadataFilename (JSONFilename), "wb")
+				print >>f, json.dumps (datautil.metadataObject (jsonObject))
+				print "..JSON metadata written to %s" % f.name
+				f.close ()
 		except exceptions.Exception, e:
 			print "--Failed to write JSON file: %s" % e
 			traceback.print_exc ()
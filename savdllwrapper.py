@@ -57,9 +57,21 @@ import getpass
 import encodings
 import functools
 import gc
+import threading
+import Queue
+import multiprocessing
+import mmap
+import hashlib
+import collections
+import itertools
+
+try:
+    import numpy
+    numpyOk = True
+except ImportError:
+    numpyOk = False
 
 psycoOk = False
-numpyOk = False
 cWriterowOK = False
 
 retcodes = {
@@ -234,6 +246,209 @@ def ISODuration (i, dp=0):
 				result = "%dD" % days + result
 	return "PT" + result
 
+durationRE = re.compile ("PT(?:(-?\d+)D)?(?:(\d+)H)?(?:(\d+)M)?(?:(\d+(?:\.\d*)?)S)?$")
+
+# Return the number of seconds of an ISO 8601 duration created by ISODuration, or
+# None for an empty value.
+def ISODurationSeconds (text):
+	if not text: return
+	match = durationRE.match (text)
+	if not match:
+		raise ValueError, "Not an ISO 8601 duration: %r" % text
+	days, hours, minutes, seconds = match.groups ()
+	result = int (days or 0)*86400 + int (hours or 0)*3600 + int (minutes or 0)*60
+	if seconds: result += float (seconds)
+	return result
+
+# Durations up to this many seconds are decomposed with integer arithmetic; floats
+# divide exactly enough there for the result to equal ISODuration's.
+maxIntegerDuration = 2**40
+maxDurationCache = 2**16
+
+def _integerDuration (i, dp=0):
+	if dp:
+		result = ("%0.*f" % (dp, i % 60)).rstrip ('0').rstrip ('.') + "S"
+		minutes = int (math.floor (i / 60))
+	else:
+		minutes, secondsInMinute = divmod (int (round (i)), 60)
+		result = "%dS" % secondsInMinute
+	if minutes:
+		if result == "0S": result = ""
+		hours, wholeMinutes = divmod (minutes, 60)
+		if wholeMinutes or result: result = "%dM" % wholeMinutes + result
+		if hours:
+			days, wholeHours = divmod (hours, 24)
+			if wholeHours or result: result = "%dH" % wholeHours + result
+			if days: result = "%dD" % days + result
+	return "PT" + result
+
+# Return a function formatting durations like ISODuration (i, dp), reusing the
+# strings of repeated values.
+def ISODurationConverter (dp=0):
+	cache = {}
+	def convert (i):
+		result = cache.get (i)
+		if result is None and i is not None:
+			if -maxIntegerDuration < i < maxIntegerDuration:
+				result = _integerDuration (i, dp)
+			else:
+				result = ISODuration (i, dp)
+			if len (cache) < maxDurationCache: cache [i] = result
+		return result
+	return convert
+
+# Bytes of the raw values and their unicode objects kept in the cache of each
+# utf-8 string column
+maxStringCacheBytes = 2**20
+
+# Strip a multi-byte character truncated by the width of a string variable from
+# the end of a utf-8 value, looking back at most three bytes for its lead byte.
+def _completeUtf8 (value):
+	if value [-1:] < "\x80": return value
+	end = len (value)
+	for back in xrange (1, min (end, 3) + 1):
+		byte = ord (value [end - back])
+		if byte < 0x80: return value
+		if byte >= 0xc0:
+			length = 2 if byte < 0xe0 else 3 if byte < 0xf0 else 4
+			return value [:end - back] if length > back else value
+	return value
+
+def _decodeUtf8 (value):
+	try:
+		return value.decode ("utf-8")
+	except UnicodeDecodeError:
+		# Other invalid bytes: decode these to Unicode substitution characters,
+		# removing them from the end like truncated characters.
+		return value.decode ("utf-8", "replace").rstrip (u"\ufffd")
+
+# Return a function decoding the values of a utf-8 string variable of width
+# varType, sharing the unicode object of repeated values until the cache holds
+# maxStringCacheBytes, so that wide open-ended columns don't grow it unbounded.
+def utf8Converter (varType):
+	cache = {}
+	cacheBytes = [0]
+	def convert (value):
+		result = cache.get (value)
+		if result is None:
+			text = value [:varType]
+			if text [-1:] >= "\x80": text = _completeUtf8 (text)
+			try:
+				result = text.decode ("utf-8")
+			except UnicodeDecodeError:
+				result = _decodeUtf8 (text)
+			if cacheBytes [0] < maxStringCacheBytes:
+				cache [value] = result
+				cacheBytes [0] += sys.getsizeof (value) + sys.getsizeof (result)
+		return result
+	return convert
+
+# Internal SPSS dates are numbers of seconds since midnight, Oct 14, 1582 (the
+# beginning of the Gregorian calendar)
+gregorianEpoch = datetime.date(1582, 10, 14).toordinal()
+minSpssDate = (datetime.date.min.toordinal() - gregorianEpoch) * 86400
+maxSpssDate = (datetime.date.max.toordinal() - gregorianEpoch + 1) * 86400
+maxDayTable = 2**16
+_isoDays = {}
+
+
+def spssDateParts(spssDateValue):
+    """This function splits an internal SPSS date into a day number, the
+    seconds since midnight and the microseconds"""
+    seconds = math.floor(spssDateValue)
+    microseconds = int(round((spssDateValue - seconds) * 1e6))
+    if microseconds == 1000000:
+        seconds, microseconds = seconds + 1, 0
+    days, seconds = divmod(int(seconds), 86400)
+    return days, seconds, microseconds
+
+
+def isoDay(days):
+    """This function returns the ISO date (yyyy-mm-dd) of a day number. Day
+    numbers are kept in a table of at most <maxDayTable> days"""
+    try:
+        return _isoDays[days]
+    except KeyError:
+        date = datetime.date.fromordinal(gregorianEpoch + days)
+        result = "%04d-%02d-%02d" % (date.year, date.month, date.day)
+        if len(_isoDays) < maxDayTable:
+            _isoDays[days] = result
+        return result
+
+
+def isoDate(spssDateValue, fmt, recodeSysmisTo=None):
+    """This function converts an internal SPSS date to <fmt>, one of the
+    formats of supportedDates, using integer day and second arithmetic.
+    Dates outside the years 1-9999 (e.g. system missing values) are returned
+    as <recodeSysmisTo>"""
+    try:
+        days, seconds, microseconds = spssDateParts(spssDateValue)
+        date = isoDay(days)
+    except (OverflowError, TypeError, ValueError):
+        return recodeSysmisTo
+    if fmt == "%Y-%m-%d":
+        return date
+    elif fmt == "%Y-%m":
+        return date[:7]
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    time = "%02d:%02d:%02d.%06d" % (hours, minutes, seconds, microseconds)
+    if fmt == "%H:%M:%S.%f":
+        return time
+    elif fmt == "%Y-%m-%dT%H:%M:%S.%f":
+        return date + "T" + time
+    return datetime.datetime.combine(
+        datetime.date.fromordinal(gregorianEpoch + days),
+        datetime.time(hours, minutes, seconds, microseconds)).strftime(fmt)
+
+
+isoDateRE = re.compile(r"(?:(\d{4})-(\d\d)(?:-(\d\d))?)?T?"
+                       r"(?:(\d\d):(\d\d):(\d\d)(\.\d*)?)?$")
+
+
+def spssDate(isoText):
+    """This function converts an ISO date (yyyy-mm-dd or yyyy-mm), time
+    (hh:mm:ss.ffffff) or date and time, as returned by isoDate, to an
+    internal SPSS date. Empty values are returned as None"""
+    if not isoText:
+        return None
+    match = isoDateRE.match(isoText)
+    if not match:
+        raise ValueError("Not an ISO date or time: %r" % isoText)
+    year, month, day, hours, minutes, seconds, fraction = match.groups()
+    result = 0.0
+    if year:
+        date = datetime.date(int(year), int(month), int(day or 1))
+        result = (date.toordinal() - gregorianEpoch) * 86400.0
+    if hours:
+        result += int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+        if fraction and len(fraction) > 1:
+            result += float(fraction)
+    return result
+
+
+def spssDatetime64(spssDateValues):
+    """This function converts a sequence of internal SPSS dates to a numpy
+    datetime64[us] array. Missing and out of range values become NaT"""
+    if not numpyOk:
+        raise ImportError("Datetime arrays require the numpy library")
+    seconds = numpy.asarray(spssDateValues, dtype=float)
+    with numpy.errstate(invalid="ignore"):
+        valid = (seconds >= minSpssDate) & (seconds < maxSpssDate)
+    seconds = numpy.where(valid, seconds, 0.0)
+    # whole seconds and microseconds separately: microseconds since 1582
+    # exceed the precision of a double
+    wholeSeconds = numpy.floor(seconds)
+    # rounded half up, like round() in isoDate
+    microseconds = numpy.floor((seconds - wholeSeconds) * 1e6 + 0.5)
+    microseconds = microseconds.astype("int64")
+    microseconds += wholeSeconds.astype("int64") * 1000000
+    result = (numpy.datetime64("1582-10-14T00:00:00", "us") +
+              microseconds.astype("timedelta64[us]"))
+    result[~valid] = numpy.datetime64("NaT")
+    return result
+
+
 class SPSSIOError(Exception):
     """
     Error class for the IBM SPSS Statistics Input Output Module
@@ -2036,6 +2251,163 @@ class SavHeaderReader(Header):
         return os.linesep.join(report)
 
 
+class SavKeyIndex(object):
+    """ Sorted index of the values of one variable of a spss data file, kept
+    in a file next to it and memory-mapped. The index records the size and
+    modification time of the spss data file, so that it is only used while
+    the file is unchanged. Membership tests go through a Bloom filter first.
+
+    Parameters:
+    -indexFileName: the file name of the index, cf. SavKeyIndex.fileName
+    -encoding: the encoding of unicode keys of string variables (default =
+        "utf-8")
+
+    Typical use:
+    SavReader(savFileName).build_index("ssn")
+    ...
+    with SavReader(savFileName, idVar="ssn") as reader:  # uses the index
+        record = reader.get("987654321")
+    """
+
+    magic = "SAVKEYS1"
+    headerStruct = struct.Struct("<8sQdQQQQI64s")
+    bloomBitsPerKey = 10
+    bloomHashes = 7
+
+    def __init__(self, indexFileName, encoding="utf-8"):
+        """ Constructor. Opens and memory-maps the index """
+        self.indexFileName = indexFileName
+        self.encoding = encoding
+        self.f = open(indexFileName, "rb")
+        self.map = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.savSize, self.savMtime, self.nCases, self.varType,
+         self.nKeys, self.bloomBits, self.bloomHashes, idVar) = \
+            self.headerStruct.unpack_from(self.map)
+        if magic != self.magic:
+            self.close()
+            raise ValueError("Not a key index: %r" % indexFileName)
+        self.idVar = idVar.rstrip("\0")
+        self.entryStruct = self._entryStruct(self.varType)
+        self.bloomOffset = self.headerStruct.size
+        self.keysOffset = self.bloomOffset + self.bloomBits // 8
+
+    @staticmethod
+    def fileName(savFileName, idVar):
+        """This function returns the file name of the index of <idVar>"""
+        root, ext = os.path.splitext(savFileName)
+        return "%s_%s.idx" % (root, idVar)
+
+    @staticmethod
+    def _entryStruct(varType):
+        if varType == 0:
+            return struct.Struct("<dQ")
+        return struct.Struct("<%dsQ" % varType)
+
+    @staticmethod
+    def _bloomPositions(keyBytes, bloomBits, bloomHashes):
+        h1, h2 = struct.unpack("<QQ", hashlib.md5(keyBytes).digest())
+        return [(h1 + i * h2) % bloomBits for i in xrange(bloomHashes)]
+
+    @classmethod
+    def write(cls, indexFileName, savFileName, idVar, varType, nCases,
+              keys):
+        """This function writes the index of <keys>, an iterable of (key,
+        case number) tuples of the values of <idVar>, with variable type
+        <varType>: 0 for numerical keys, the width for (byte) string keys"""
+        entries = sorted(keys)
+        bloomBits = max(64, len(entries) * cls.bloomBitsPerKey + 7) // 8 * 8
+        bloom = bytearray(bloomBits // 8)
+        for key, case in entries:
+            keyBytes = cls._keyBytes(key, varType)
+            for bit in cls._bloomPositions(keyBytes, bloomBits,
+                                           cls.bloomHashes):
+                bloom[bit >> 3] |= 1 << (bit & 7)
+        entryStruct = cls._entryStruct(varType)
+        with open(indexFileName, "wb") as f:
+            f.write(cls.headerStruct.pack(
+                cls.magic, os.path.getsize(savFileName),
+                os.path.getmtime(savFileName), nCases, varType, len(entries),
+                bloomBits, cls.bloomHashes, idVar))
+            f.write(str(bloom))
+            pack = entryStruct.pack
+            for start in xrange(0, len(entries), 10000):
+                f.write("".join([pack(key, case) for key, case in
+                                 entries[start:start + 10000]]))
+
+    @staticmethod
+    def _keyBytes(key, varType):
+        if varType == 0:
+            return struct.pack("<d", key + 0.0)  # -0.0 == 0.0
+        return key
+
+    def isValid(self, savFileName):
+        """This function returns True if the index is up to date with the
+        spss data file"""
+        return (os.path.getsize(savFileName) == self.savSize and
+                os.path.getmtime(savFileName) == self.savMtime)
+
+    def _key(self, key):
+        """This function returns <key> as stored in the index, or None if no
+        value of the variable can equal it"""
+        if self.varType == 0:
+            if isinstance(key, (int, long, float)):
+                return float(key)
+            return None
+        if isinstance(key, unicode):
+            key = key.encode(self.encoding)
+        if not isinstance(key, str) or len(key) > self.varType:
+            return None
+        return key.rstrip()
+
+    def mightContain(self, key):
+        """This function returns False if <key> is certainly not in the
+        index (Bloom filter)"""
+        key = self._key(key)
+        if key is None:
+            return False
+        bloomOffset, map_ = self.bloomOffset, self.map
+        for bit in self._bloomPositions(self._keyBytes(key, self.varType),
+                                        self.bloomBits, self.bloomHashes):
+            if not ord(map_[bloomOffset + (bit >> 3)]) & (1 << (bit & 7)):
+                return False
+        return True
+
+    def _keyAt(self, i):
+        return self.entryStruct.unpack_from(
+            self.map, self.keysOffset + i * self.entryStruct.size)
+
+    def cases(self, key):
+        """This function returns the case numbers, in ascending order, of
+        the cases whose value equals <key>"""
+        if not self.mightContain(key):
+            return []
+        key = self._key(key)
+        if self.varType:
+            key = key.ljust(self.varType, "\0")  # as packed by struct
+        lo, hi = 0, self.nKeys
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._keyAt(mid)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        cases = []
+        for i in xrange(lo, self.nKeys):
+            entryKey, case = self._keyAt(i)
+            if entryKey != key:
+                break
+            cases.append(case)
+        return cases
+
+    def __contains__(self, key):
+        return bool(self.cases(key))
+
+    def close(self):
+        """This function closes the index"""
+        self.map.close()
+        self.f.close()
+
+
 class SavReader(Header):
     """ Read Spss system files (.sav, .zsav)
 
@@ -2063,6 +2435,14 @@ class SavReader(Header):
         and False (Codepage mode). Cf. SET UNICODE=ON/OFF (default = False)
     -ioLocale: indicates the locale of the I/O module. Cf. SET LOCALE (default
         = None, which corresponds to locale.getlocale()[0])
+    -readAhead: number of cases a background thread reads ahead into a ring
+        of case buffers while earlier cases are formatted, so that reading
+        and formatting overlap. If 0, cases are read in sequence (default = 0)
+    -cacheSize: maximum size in bytes of a least-recently-used cache of
+        blocks of formatted cases, used by indexing and slicing (and so by
+        head, tail and get). The size of the formatted records (the lists
+        and their values) is counted, not that of the cases in the file. If
+        0, nothing is cached (default = 0)
 
     Typical use:
     savFileName = "d:/someFile.sav"
@@ -2074,11 +2454,15 @@ class SavReader(Header):
 
     def __init__(self, savFileName, returnHeader=False, recodeSysmisTo=None,
                  verbose=False, selectVars=None, idVar=None, rawMode=False,
-                 ioUtf8=False, ioLocale=None):
+                 ioUtf8=False, ioLocale=None, readAhead=0, cacheSize=0):
         """ Constructor. Initializes all vars that can be recycled """
         super(SavReader, self).__init__(savFileName, "rb", None,
                                         ioUtf8, ioLocale)
         self.savFileName = savFileName
+        self.readAhead = readAhead
+        self.cacheSize = cacheSize
+        self.cache = collections.OrderedDict()
+        self.cacheBytes = self.cacheHits = self.cacheMisses = 0
         self.returnHeader = returnHeader
         self.recodeSysmisTo = recodeSysmisTo
         self.verbose = verbose
@@ -2099,6 +2483,7 @@ class SavReader(Header):
         self.unpack_from = self.myStruct.unpack_from
         self.seekNextCase = self.spssio.spssSeekNextCase
         self.caseBuffer = self.getCaseBuffer()
+        self.converters = self._compileConverters()
 
         if psycoOk:
             self._items = psyco.proxy(self._items)  # 3 x faster!
@@ -2119,6 +2504,8 @@ class SavReader(Header):
 
     def close(self):
         """This function closes the spss data file and does some cleaning."""
+        if getattr(self, "keyIndex", None):
+            self.keyIndex.close()
         if not segfaults:
             self.closeSavFile(self.fh, mode="rb")
         del self.spssio
@@ -2169,51 +2556,51 @@ class SavReader(Header):
         items = [hasDates, hasNfmt, hasRecodeSysmis, self.ioUtf8_]
         return False if any(items) else True
 
-    def formatValues(self, record):
-        """This function formats date fields to ISO dates (yyyy-mm-dd), plus
-        some other date/time formats. The SPSS N format is formatted to a
-        character value with leading zeroes. System missing values are recoded
-        to <recodeSysmisTo>. If rawMode==True, this function does nothing"""
-        if self.rawMode or self.autoRawMode:
-            return record  # 6-7 times faster!
-
-        for i, value in enumerate(record):
-            varName = self.header[i]
+    def _compileConverters(self):
+        """Helper function for formatValues function. Returns a list of
+        (index, converter) tuples, one for each column of a record that needs
+        formatting. Columns whose values are returned as they are (e.g.,
+        codepage strings that need no trimming) are left out."""
+        converters = []
+        sysmis, recodeSysmisTo = self.sysmis_, self.recodeSysmisTo
+        for i, varName in enumerate(self.header):
             varType = self.varTypes[varName]
             bareformat_ = self.bareformats[varName]
-            varWid = self.varWids[varName]
-            varDP = self.varDPs[varName]
             if varType == 0:
-                # recode system missing values, if present and desired
-                if value > self.sysmis_:
-                    pass
-                else:
-                    record[i] = self.recodeSysmisTo
                 # format N-type values (=numerical with leading zeroes)
                 if bareformat_ == "N":
-                    #record[i] = str(value).zfill(varWid)
-                    record[i] = "%%0%dd" % varWid % value  #15 x faster (zfill)
+                    fmt = "%%0%dd" % self.varWids[varName]  # 15 x faster (zfill)
+                    convert = lambda value, fmt=fmt: fmt % value
                 # convert SPSS dates to ISO dates
                 elif bareformat_ in supportedDates:
-                    fmt = supportedDates[bareformat_]
-                    args = (value, fmt, self.recodeSysmisTo)
-                    record[i] = self.spss2strDate(*args)
+                    convert = functools.partial(isoDate,
+                        fmt=supportedDates[bareformat_],
+                        recodeSysmisTo=recodeSysmisTo)
                 elif bareformat_ == "DTIME":
-                    record[i] = ISODuration (value, varDP)
-            elif varType > 0:
-                value = value[:varType]
-                if self.ioUtf8_:
-                    try:
-                    	record[i] = value.decode("utf-8")
-                    except:
-                        # Occasionally Unicode substitution characters appear at the end when
-                        # multi-byte characters have been truncated. Remove these.
-                    	record [i] = value.decode("utf-8", errors="replace")\
-                    		.rstrip (u"\ufffd")
-                    	#print "--Truncated utf-8 value for %s (%d): '%s'" %\
-                    	#   (varName, i, record [i].encode ("ascii", errors="xmlcharrefreplace"))
+                    convert = ISODurationConverter(self.varDPs[varName])
+                # recode system missing values, if present and desired
                 else:
-                    record[i] = value
+                    convert = lambda value: \
+                        value if value > sysmis else recodeSysmisTo
+            elif self.ioUtf8_:
+                convert = utf8Converter(varType)
+            elif varType % 8:
+                convert = operator.itemgetter(slice(None, varType))
+            else:
+                continue
+            converters.append((i, convert))
+        return converters
+
+    def formatValues(self, record):
+        """This function formats date fields to ISO dates (yyyy-mm-dd), plus
+        some other date/time formats. The SPSS N format is formatted to a
+        character value with leading zeroes. System missing values are recoded
+        to <recodeSysmisTo>. If rawMode==True, this function does nothing"""
+        if self.rawMode or self.autoRawMode:
+            return record  # 6-7 times faster!
+
+        for i, convert in self.converters:
+            record[i] = convert(record[i])
         return record
 
     def _items(self, start=0, stop=None, step=1, returnHeader=False):
@@ -2232,16 +2619,23 @@ class SavReader(Header):
             stop = self.nCases
 
         selection = self.selectVars is not None
+        # a thread and its buffers only pay for themselves over more cases
+        # than the ring holds, e.g. not for a single case of __getitem__
+        readAhead = (self.readAhead and step == 1 and
+                     stop - start > self.readAhead + 1)
+        if readAhead:
+            records = self._readAhead(max(stop - start, 0))
         for case in xrange(start, stop, step):
-            if start:
-                # only call this when iterating over part of the records
+            if start and (step != 1 or case == start):
+                # only call this when iterating over part of the records;
+                # consecutive cases follow on without seeking
                 retcode = self.seekNextCase(c_int(self.fh), c_long(case))
                 if retcode > 0:
                     raise SPSSIOError("Error seeking case %d" % case, retcode)
             elif stop == self.nCases:
                 self.printPctProgress(case, self.nCases)
 
-            record = self.record
+            record = records.next() if readAhead else self.record
 
             if selection:
                 record = self.selector(record)
@@ -2249,6 +2643,53 @@ class SavReader(Header):
             record = self.formatValues(record)
             yield record
 
+    def _readAhead(self, nCases):
+        """ This is a helper function for _items. It reads <nCases>
+        consecutive cases from the current position in a background thread,
+        into a ring of readAhead + 1 preallocated case buffers, and yields
+        them unpacked. The thread only fills a buffer once the previous
+        case in it has been unpacked. """
+        buffers = [self.getCaseBuffer() for i in xrange(self.readAhead + 1)]
+        free, filled = Queue.Queue(), Queue.Queue()
+        for i in xrange(len(buffers)):
+            free.put(i)
+        stopping = threading.Event()
+        fh = c_int(self.fh)
+
+        def produce():
+            # any error is passed to the consumer, which would otherwise
+            # wait forever for the case
+            try:
+                for case in xrange(nCases):
+                    i = free.get()
+                    if stopping.is_set():
+                        return
+                    retcode = self.wholeCaseIn(fh, byref(buffers[i]))
+                    if retcode > 0:
+                        raise SPSSIOError("Problem reading row", retcode)
+                    filled.put(i)
+            except Exception:
+                filled.put(sys.exc_info())
+
+        producer = threading.Thread(target=produce)
+        producer.daemon = True
+        producer.start()
+        unpack_from = self.unpack_from
+        try:
+            for case in xrange(nCases):
+                i = filled.get()
+                if isinstance(i, tuple):
+                    raise i[0], i[1], i[2]
+                record = list(unpack_from(buffers[i]))
+                free.put(i)
+                yield record
+        finally:
+            # let the thread finish with the file handle before it is used
+            # again (e.g. seeked or closed)
+            stopping.set()
+            free.put(None)
+            producer.join()
+
     def __iter__(self):
         """This function allows the object to be used as an iterator"""
         return self._items(0, None, 1, self.returnHeader)
@@ -2276,11 +2717,65 @@ class SavReader(Header):
             stop = start + 1
             step = 1
 
-        records = self._items(start, stop, step)
+        if self.cacheSize:
+            records = self._cachedItems(start, stop, step)
+        else:
+            records = self._items(start, stop, step)
         if is_slice:
             return list(records)
         return next(records)
 
+    cacheBlockCases = 256
+
+    def _cachedItems(self, start, stop, step):
+        """ This is a helper function to implement __getitem__ through the
+        block cache. Records are read and formatted in blocks of
+        <cacheBlockCases> cases, and the least recently used blocks are
+        dropped once the blocks exceed <cacheSize> bytes, as estimated by
+        _blockSize from the formatted records. """
+        block = lastBlockNo = None
+        for case in xrange(start, stop, step):
+            blockNo, i = divmod(case, self.cacheBlockCases)
+            if blockNo != lastBlockNo:
+                entry = self.cache.pop(blockNo, None)
+                if entry is None:
+                    self.cacheMisses += 1
+                    blockStart = blockNo * self.cacheBlockCases
+                    blockStop = min(blockStart + self.cacheBlockCases,
+                                    self.nCases)
+                    block = list(self._items(blockStart, blockStop))
+                    size = self._blockSize(block)
+                    # the new block is kept even if it exceeds cacheSize
+                    while self.cache and \
+                          self.cacheBytes + size > self.cacheSize:
+                        self.cacheBytes -= self.cache.popitem(last=False)[1][1]
+                    self.cacheBytes += size
+                    entry = (block, size)
+                else:
+                    self.cacheHits += 1
+                    block = entry[0]
+                self.cache[blockNo] = entry  # most recently used
+                lastBlockNo = blockNo
+            yield list(block[i])
+
+    def _blockSize(self, block):
+        """ This is a helper function for _cachedItems. It returns the size
+        in bytes of a block of formatted records: the lists and the values in
+        them, counting values shared between records (e.g. decoded strings)
+        for each record they appear in """
+        getsizeof = sys.getsizeof
+        size = getsizeof(block)
+        for record in block:
+            size += getsizeof(record) + sum(map(getsizeof, record))
+        return size
+
+    def cacheInfo(self):
+        """ This function reports the hits, misses and size of the block
+        cache used by __getitem__ """
+        return {"hits": self.cacheHits, "misses": self.cacheMisses,
+                "blocks": len(self.cache), "bytes": self.cacheBytes,
+                "maxBytes": self.cacheSize}
+
     def _get_array_slice(self, key, nRows, nCols):
         """This is a helper function to implement array slicing with numpy"""
 
@@ -2377,14 +2872,73 @@ class SavReader(Header):
         <idVar> contains <item>. Thus, it requires the 'idVar' parameter to
         be set. For example: reader = SavReader(savFileName, idVar="ssn")
         "987654321" in reader """
+        keyIndex = self._getKeyIndex()
+        if keyIndex:
+            return item in keyIndex
         return bool(self.get(item))
 
+    def build_index(self, idVar=None):
+        """ This function writes a sorted index of the values of <idVar>
+        (default: the idVar of the reader) to a file next to the spss data
+        file, cf. SavKeyIndex, and returns its file name. The 'get' method and
+        membership tests then use the index instead of reading the whole
+        file, also in later readers with this idVar, as long as the spss data
+        file is unchanged.
+        For example: SavReader(savFileName).build_index("ssn")"""
+        idVar = idVar or self.idVar
+        if not idVar in self.varNames:
+            raise NameError("%r is not a variable in the file" % idVar)
+        idPos = self.varNames.index(idVar)
+        varType = self.varTypes[idVar]
+
+        def keys():
+            for case in xrange(self.nCases):
+                value = self.record[idPos]
+                if varType:
+                    value = value[:varType].rstrip()
+                yield value, case
+
+        self.seekNextCase(c_int(self.fh), c_long(0))
+        try:
+            indexFileName = SavKeyIndex.fileName(self.savFileName, idVar)
+            SavKeyIndex.write(indexFileName, self.savFileName, idVar,
+                              varType, self.nCases, keys())
+        finally:
+            self.seekNextCase(c_int(self.fh), c_long(0))
+        if getattr(self, "keyIndex", None):
+            self.keyIndex.close()
+        self.idVar = idVar
+        self.keyIndex = SavKeyIndex(indexFileName, self._keyEncoding())
+        return indexFileName
+
+    def _keyEncoding(self):
+        return "utf-8" if self.ioUtf8_ else self.fileEncoding
+
+    def _getKeyIndex(self):
+        """ This function returns the index of idVar written by build_index,
+        if it exists and is up to date, else None"""
+        if not hasattr(self, "keyIndex"):
+            self.keyIndex = None
+            if self.idVar in self.varNames:
+                indexFileName = SavKeyIndex.fileName(self.savFileName,
+                                                     self.idVar)
+                if os.path.exists(indexFileName):
+                    keyIndex = SavKeyIndex(indexFileName, self._keyEncoding())
+                    if keyIndex.isValid(self.savFileName):
+                        self.keyIndex = keyIndex
+                    else:
+                        keyIndex.close()
+        if self.keyIndex and self.keyIndex.idVar != self.idVar:
+            return None
+        return self.keyIndex
+
     def get(self, key, default=None, full=False):
         """ This function returns the records for which <idVar> == <key>
         if <key> in <savFileName>, else <default>. Thus, the function mimics
         dict.get, but note that dict[key] is NOT implemented. NB: Even though
         this uses a binary search, this is not very fast on large data (esp.
-        the first call, and with full=True)
+        the first call, and with full=True), unless an index of <idVar> was
+        written with build_index
 
         Parameters:
         -key: key for which the corresponding record should be returned
@@ -2400,6 +2954,15 @@ class SavReader(Header):
                    "variable as an idVar argument")
             raise NameError(msg)
 
+        keyIndex = self._getKeyIndex()
+        if keyIndex:
+            cases = keyIndex.cases(key)
+            if full:
+                result = [self[case] for case in cases]
+            else:
+                result = self[cases[0]] if cases else None
+            return result if result else default
+
         #two slightly modified functions from the bisect module
         def bisect_right(a, x, lo=0, hi=None):
             if hi is None:
@@ -2456,37 +3019,11 @@ class SavReader(Header):
         return (self.numVars, self.nCases, self.varNames, self.varTypes,
                 self.formats, self.varLabels, self.valueLabels)
 
-    def memoize(f):
-        """Memoization decorator
-        http://code.activestate.com/recipes/577219-minimalistic-memoization/"""
-        cache = {}
-        MAXCACHE = 10**4
-
-        def memf(*x):
-            if x not in cache:
-                cache[x] = f(*x)
-            if len(cache) > MAXCACHE:
-                cache.popitem()
-            return cache[x]
-        return memf
-
-    @memoize
     def spss2strDate(self, spssDateValue, fmt, recodeSysmisTo):
         """This function converts internal SPSS dates (number of seconds
         since midnight, Oct 14, 1582 (the beginning of the Gregorian calendar))
         to a human-readable format"""
-        try:
-            if not hasattr(self, "gregorianEpoch"):
-                self.gregorianEpoch = datetime.datetime(1582, 10, 14, 0, 0, 0)
-            theDate = (self.gregorianEpoch +
-                       datetime.timedelta(seconds=spssDateValue))
-            return datetime.datetime.strftime(theDate, fmt)
-        except OverflowError:
-            return recodeSysmisTo
-        except TypeError:
-            return recodeSysmisTo
-        except ValueError:
-            return recodeSysmisTo
+        return isoDate(spssDateValue, fmt, recodeSysmisTo)
 
     def getFileReport(self, savFileName, varNames, varTypes,
                       formats, nCases):
@@ -2562,6 +3099,163 @@ class SavReader(Header):
         return header
 
 
+def _parallelReaderInit(savFileName, readerArgs):
+    """Process pool initializer for SavParallelReader: opens this worker's
+    own file handle"""
+    global _parallelReader
+    _parallelReader = SavReader(savFileName, **readerArgs)
+
+
+def _parallelReaderChunk(chunk):
+    """Process pool task for SavParallelReader: reads one range of cases"""
+    start, stop = chunk
+    return list(_parallelReader._items(start, stop))
+
+
+class SavParallelReader(object):
+    """ Read the cases of a spss data file through several file handles at
+    once. The cases are divided into ranges of <chunkSize> cases, and each
+    worker reads and formats whole ranges through its own file handle, so
+    I/O Module calls (which release the GIL) and formatting overlap.
+
+    Parameters:
+    -savFileName: the file name of the spss data file
+    -nHandles: number of file handles, and so of worker threads or
+        processes (default = 4)
+    -ordered: Boolean that indicates whether cases should be returned in
+        file order. If False, ranges are returned as they are completed,
+        which suits aggregations (default = True)
+    -useProcesses: Boolean that indicates whether workers should be
+        processes rather than threads (default = False)
+    -chunkSize: number of cases in each range (default = 10000)
+    -readerArgs: any further keyword arguments are passed to SavReader for
+        each file handle (e.g. ioUtf8, recodeSysmisTo, selectVars)
+
+    Typical use:
+    with SavParallelReader(savFileName, nHandles=4, ioUtf8=True) as sav:
+        for line in sav:
+            process(line)
+    """
+
+    def __init__(self, savFileName, nHandles=4, ordered=True,
+                 useProcesses=False, chunkSize=10000, **readerArgs):
+        """ Constructor. Opens the first file handle to get the case count """
+        self.savFileName = savFileName
+        self.nHandles = nHandles
+        self.ordered = ordered
+        self.useProcesses = useProcesses
+        self.chunkSize = chunkSize
+        self.readerArgs = readerArgs
+        readerArgs.pop("returnHeader", None)
+        self.readers = [SavReader(savFileName, **readerArgs)]
+        self.nCases = len(self.readers[0])
+        self.header = self.readers[0].header
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
+
+    def close(self):
+        """This function closes all the file handles"""
+        for reader in self.readers:
+            reader.close()
+        self.readers = []
+
+    def __len__(self):
+        return self.nCases
+
+    def chunks(self, start=0, stop=None):
+        """This function returns the (start, stop) case ranges"""
+        if stop is None:
+            stop = self.nCases
+        return [(case, min(case + self.chunkSize, stop))
+                for case in xrange(start, stop, self.chunkSize)]
+
+    def __iter__(self):
+        """This function allows the object to be used as an iterator"""
+        for records in self.iterChunks():
+            for record in records:
+                yield record
+
+    def iterChunks(self, start=0, stop=None):
+        """This function yields the records of each case range as a list,
+        in file order if <ordered>"""
+        chunks = self.chunks(start, stop)
+        if self.useProcesses:
+            return self._processChunks(chunks)
+        return self._threadChunks(chunks)
+
+    def _processChunks(self, chunks):
+        pool = multiprocessing.Pool(self.nHandles, _parallelReaderInit,
+                                    (self.savFileName, self.readerArgs))
+        try:
+            if self.ordered:
+                results = pool.imap(_parallelReaderChunk, chunks)
+            else:
+                results = pool.imap_unordered(_parallelReaderChunk, chunks)
+            for records in results:
+                yield records
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _threadChunks(self, chunks):
+        while len(self.readers) < min(self.nHandles, len(chunks)):
+            self.readers.append(SavReader(self.savFileName, **self.readerArgs))
+        tasks = Queue.Queue()
+        for task in enumerate(chunks):
+            tasks.put(task)
+        results = Queue.Queue()
+        # at most two ranges per handle are read ahead of the consumer
+        readAhead = threading.BoundedSemaphore(2 * len(self.readers))
+        stopping = threading.Event()
+
+        def work(reader):
+            while not stopping.is_set():
+                readAhead.acquire()
+                try:
+                    index, (start, stop) = tasks.get_nowait()
+                except Queue.Empty:
+                    readAhead.release()
+                    return
+                try:
+                    results.put((index, list(reader._items(start, stop))))
+                except Exception, e:
+                    results.put((index, e))
+                    return
+
+        workers = [threading.Thread(target=work, args=(reader,))
+                   for reader in self.readers[:len(chunks)]]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        try:
+            pending = {}
+            for nextIndex in xrange(len(chunks)):
+                if self.ordered:
+                    while nextIndex not in pending:
+                        index, records = results.get()
+                        pending[index] = records
+                    records = pending.pop(nextIndex)
+                else:
+                    index, records = results.get()
+                if isinstance(records, Exception):
+                    raise records
+                readAhead.release()
+                yield records
+        finally:
+            stopping.set()
+            for worker in workers:
+                while worker.is_alive():
+                    try:
+                        readAhead.release()
+                    except ValueError:
+                        pass
+                    worker.join(0.1)
+
+
 class SavWriter(Header):
 
     """ Write Spss system files (.sav, .zsav)
@@ -2828,8 +3522,17 @@ class SavWriter(Header):
             return
         self.pyWriterow(record)
 
+    def _checkRecordLength(self, length, case=None):
+        """Helper function that raises a ValueError unless a record of
+        <length> values has one value for each variable"""
+        if length != len(self.varNames):
+            which = "Record" if case is None else "Record %d" % case
+            raise ValueError("%s has %d values, but there are %d variables" %
+                             (which, length, len(self.varNames)))
+
     def pyWriterow(self, record):
         """ This function writes one record, which is a Python list."""
+        self._checkRecordLength(len(record))
         float_ = float
         for i, value in enumerate(record):
             varName = self.varNames[i]
@@ -2850,18 +3553,122 @@ class SavWriter(Header):
             record[i] = value
         self.record = record
 
+    writeBatchCases = 1000
+
     def writerows(self, records):
-        """ This function writes all records."""
-        nCases = len(records)
-        for case, record in enumerate(records):
-            self.writerow(record)
-            self.printPctProgress(case, nCases)
+        """ This function writes all records. <records> may be any iterable of
+        records (Python lists or tuples), a numpy structured array, or a dict
+        that maps variable names to columns of equal length. The records are
+        converted column by column and packed <writeBatchCases> cases at a
+        time into one contiguous buffer."""
+        if isinstance(records, dict):
+            columns = [records[varName] for varName in self.varNames]
+        elif numpyOk and isinstance(records, numpy.ndarray) and \
+                records.dtype.names:
+            columns = [records[varName] for varName in self.varNames]
+        else:
+            columns = None
+        if columns is not None:
+            nCases = len(columns[0]) if columns else 0
+            for varName, column in zip(self.varNames, columns):
+                if len(column) != nCases:
+                    raise ValueError("Column %s has %d values, but column %s "
+                                     "has %d" % (varName, len(column),
+                                                 self.varNames[0], nCases))
+            for start in xrange(0, nCases, self.writeBatchCases):
+                stop = start + self.writeBatchCases
+                batch = []
+                for column in columns:
+                    column = column[start:stop]
+                    batch.append(column.tolist() if hasattr(column, "tolist")
+                                 else list(column))
+                self._writeColumns(batch)
+            return
+        records = iter(records)
+        written = 0
+        while True:
+            batch = list(itertools.islice(records, self.writeBatchCases))
+            if not batch:
+                break
+            # zip would silently cut ragged records to the shortest
+            for case, record in enumerate(batch):
+                self._checkRecordLength(len(record), written + case)
+            self._writeColumns(map(list, zip(*batch)))
+            written += len(batch)
+
+    def _columnConverters(self):
+        """Helper function for writerows. Returns a function for each variable
+        that converts a column of values like pyWriterow."""
+        sysmis = self.sysmis_
+
+        def numeric(column):
+            try:
+                return map(float, column)
+            except (ValueError, TypeError):
+                pass
+            result = []
+            for value in column:
+                try:
+                    result.append(float(value))
+                except (ValueError, TypeError):
+                    result.append(sysmis)
+            return result
+
+        def string(pad):
+            def convert(column):
+                # Get rid of trailing null bytes --> 7 x faster than 'ljust'
+                column = [pad % value for value in column]
+                if self.ioUtf8_:
+                    column = [value.encode("utf-8")
+                              if isinstance(value, unicode) else value
+                              for value in column]
+                return column
+            return convert
+
+        return [string(self.pad_8_lookup[self.varTypes[varName]])
+                if self.varTypes[varName] else numeric
+                for varName in self.varNames]
+
+    def _writeColumns(self, columns):
+        """Helper function for writerows. Packs a batch of cases, given as
+        one list per variable, into one buffer and writes them."""
+        if not hasattr(self, "columnConverters"):
+            self.columnConverters = self._columnConverters()
+            self.caseSize = max(self.myStruct.size,
+                                len(getattr(self, "caseBuffer", "")))
+            self.batchStructs = {}
+        nVars = len(columns)
+        nCases = len(columns[0]) if columns else 0
+        if not nCases:
+            return
+        batchStruct = self.batchStructs.get(nCases)
+        if batchStruct is None:
+            fmt = self.myStruct.format
+            padding = "%dx" % (self.caseSize - self.myStruct.size)
+            batchStruct = struct.Struct(fmt[0] + (fmt[1:] + padding) * nCases)
+            self.batchStructs = {nCases: batchStruct}
+        values = [None] * (nVars * nCases)
+        for i, (convert, column) in enumerate(zip(self.columnConverters,
+                                                  columns)):
+            values[i::nVars] = convert(column)
+        buffer_ = create_string_buffer(batchStruct.size)
+        try:
+            batchStruct.pack_into(buffer_, 0, *values)
+        except struct.error, e:
+            msg = "Use ioUtf8=True to write unicode strings [%s]" % e
+            raise TypeError(msg)
+        fh, address = c_int(self.fh), addressof(buffer_)
+        for case in xrange(nCases):
+            retcode = self.wholeCaseOut(fh,
+                                        c_void_p(address + case * self.caseSize))
+            if retcode > 0:
+                raise SPSSIOError("Problem writing row %d of batch" % case,
+                                  retcode)
 
 if __name__ == "__main__":
 
     import contextlib
     import csv
-    import collections
     import pprint
     import cProfile
     import pstats
@@ -0,0 +1,367 @@
+# savwriter
+#
+# Writes SPSS .sav files in pure Python, where the IBM SPSS I/O module used by
+# savdllwrapper is not available. The dictionary (variables with their labels,
+# formats and missing values, value labels, long variable names, very long strings
+# and multiple response sets) is followed by the case data, uncompressed or
+# bytecode compressed. Cases are written as they arrive, so only a buffer of
+# encoded cases is held in memory. Text is written in UTF-8.
+#
+# The parameters follow savdllwrapper.SavWriter.
+
+import datetime
+import itertools
+import re
+import struct
+import sys
+
+import savdllwrapper
+from version import savutilName, savutilVersion
+
+formatRE = re.compile ("([A-Z]+)(\d+)(\.(\d+))?")
+
+# Format type codes by bare format, e.g. formatCodes ["F"] == 5
+formatCodes = dict ((name [len ("SPSS_FMT_"):].replace ("_", ""), code)
+	for code, (name, description) in savdllwrapper.allFormats.items ())
+
+sysmis = -sys.float_info.max
+highest = sys.float_info.max
+lowest = struct.unpack ("<d", "\xfe\xff\xff\xff\xff\xff\xef\xff") [0]
+
+# Bytecode compression: values are described by codes in blocks of eight, each
+# block followed by the 8-byte values that could not be coded
+compressionBias = 100
+codeRaw = 253
+codeSpaces = 254
+codeSysmis = 255
+spaces = " "*8
+
+# Very long strings are written as segments of 255 bytes (256 in the case);
+# each counts for 252 bytes of the declared width but holds 255 bytes of the
+# value, the last holding the rest of the width
+segmentData = 252
+maxShortString = 255
+
+def roundUp (n, multiple):
+	return -multiple*(-n // multiple)
+
+def encoded (text):
+	if isinstance (text, unicode):
+		return text.encode ("utf-8")
+	return str (text)
+
+def padded (text, length, multiple=1):
+	return text.ljust (roundUp (max (length, len (text)), multiple)) [:roundUp (length, multiple)]
+
+def formatCode (format_):
+	parsedFormat = formatRE.match (format_)
+	if not parsedFormat or parsedFormat.group (1) not in formatCodes:
+		raise ValueError, "unsupported format '%s'" % format_
+	width = int (parsedFormat.group (2))
+	dp = int (parsedFormat.group (4) or 0)
+	return formatCodes [parsedFormat.group (1)] << 16 | width << 8 | dp
+
+class ShortNames:
+	# Unique 8-byte upper case names for the variable records; the full
+	# names are given in the long variable names record
+	def __init__ (self):
+		self.names = set ()
+
+	def add (self, name):
+		base = re.sub ("[^A-Z0-9_@#$.]", "", encoded (name).upper ())
+		if not base or not base [0].isalpha ():
+			base = "V" + base
+		shortName = base [:8]
+		counter = 1
+		while shortName in self.names:
+			suffix = str (counter)
+			shortName = base [:8 - len (suffix)] + suffix
+			counter += 1
+		self.names.add (shortName)
+		return shortName
+
+class SavVariable:
+	def __init__ (self, name, varType, shortNames):
+		self.name = encoded (name)
+		self.varType = varType
+		self.shortName = shortNames.add (name)
+		# (short name, width, bytes of data, bytes in the case) of each segment
+		if varType <= maxShortString:
+			self.segments = [(self.shortName, varType, varType, roundUp (varType, 8) or 8)]
+		else:
+			count = roundUp (varType, segmentData) // segmentData
+			self.segments = [(self.shortName if index == 0 else shortNames.add (name),
+				maxShortString, maxShortString, maxShortString + 1)
+				for index in xrange (count - 1)]
+			lastWidth = varType - (count - 1)*segmentData
+			self.segments.append ((shortNames.add (name), lastWidth, lastWidth,
+				roundUp (lastWidth, 8)))
+		self.caseBytes = sum (segment [3] for segment in self.segments)
+
+	# The 8-byte elements of one value in a case
+	def elements (self, value):
+		if self.varType == 0:
+			try:
+				return [float (value)]
+			except (ValueError, TypeError):
+				return [sysmis]
+		if value is None:
+			value = ""
+		else:
+			value = encoded (value)
+		result = []
+		offset = 0
+		for shortName, width, dataBytes, caseBytes in self.segments:
+			chunk = value [offset:offset + dataBytes].ljust (caseBytes)
+			offset += dataBytes
+			result.extend (chunk [index:index + 8] for index in xrange (0, caseBytes, 8))
+		return result
+
+class SavWriter (object):
+	"""
+	Writes a .sav file without the IBM SPSS I/O module.
+
+	varNames is the sequence of variable names, varTypes maps each name to 0
+	for numeric variables or the width in bytes of string variables. The
+	optional dictionary arguments take the forms used by savdllwrapper.SavWriter:
+	valueLabels {name: {value: label}}, varLabels {name: label}, formats
+	{name: "F8.2"}, missingValues {name: {"values": [...]}} or {name:
+	{"lower": l, "upper": u[, "value": v]}}, multRespDefs {setName:
+	{"setType": "C"|"D"|"E", "label": ..., "varNames": [...], ...}}.
+	"""
+
+	def __init__ (self, savFileName, varNames, varTypes, valueLabels=None,
+		varLabels=None, formats=None, missingValues=None, multRespDefs=None,
+		caseWeightVar=None, fileLabel=None, compressed=True, bufferSize=2**20):
+		self.savFileName = savFileName
+		self.compressed = compressed
+		self.bufferSize = bufferSize
+		shortNames = ShortNames ()
+		self.variables = [SavVariable (name, varTypes [name], shortNames)
+			for name in varNames]
+		self.caseCount = 0
+		self.buffer = []
+		self.bufferedBytes = 0
+		self.codes = []
+		self.raw = []
+		self.f = open (savFileName, "wb")
+		self.writeDictionary (valueLabels or {}, varLabels or {}, formats or {},
+			missingValues or {}, multRespDefs or {}, caseWeightVar, fileLabel)
+
+	def __enter__ (self):
+		return self
+
+	def __exit__ (self, type, value, tb):
+		self.close ()
+
+	def writeDictionary (self, valueLabels, varLabels, formats, missingValues,
+		multRespDefs, caseWeightVar, fileLabel):
+		f = self.f
+		caseSize = sum (variable.caseBytes for variable in self.variables) // 8
+		weightIndex = 0
+		obsIndex = 1
+		obsIndexes = []
+		for variable in self.variables:
+			obsIndexes.append (obsIndex)
+			if variable.name == encoded (caseWeightVar or ""):
+				weightIndex = obsIndex
+			obsIndex += variable.caseBytes // 8
+		now = datetime.datetime.now ()
+		f.write (struct.pack ("<4s60s5id9s8s64s3x",
+			"$FL2",
+			padded ("@(#) SPSS DATA FILE %s %s" % (savutilName, savutilVersion), 60),
+			2, caseSize, 1 if self.compressed else 0, weightIndex, -1,
+			float (compressionBias),
+			now.strftime ("%d %b %y"), now.strftime ("%H:%M:%S"),
+			padded (encoded (fileLabel or ""), 64)))
+
+		for variable in self.variables:
+			self.writeVariable (variable, varLabels.get (variable.name) or
+				varLabels.get (variable.name.decode ("utf-8")),
+				formats.get (variable.name) or formats.get (variable.name.decode ("utf-8")),
+				missingValues.get (variable.name) or
+				missingValues.get (variable.name.decode ("utf-8")))
+
+		longStringLabels = []
+		for variable, obsIndex in zip (self.variables, obsIndexes):
+			labels = valueLabels.get (variable.name) or\
+				valueLabels.get (variable.name.decode ("utf-8"))
+			if not labels:
+				continue
+			if variable.varType > 8:
+				longStringLabels.append ((variable, labels))
+				continue
+			f.write (struct.pack ("<2i", 3, len (labels)))
+			for value, label in sorted (labels.items ()):
+				if variable.varType == 0:
+					f.write (struct.pack ("<d", float (value)))
+				else:
+					f.write (padded (encoded (value), 8))
+				label = encoded (label) [:255]
+				f.write (padded (struct.pack ("B", len (label)) + label, 1 + len (label), 8))
+			f.write (struct.pack ("<3i", 4, 1, obsIndex))
+
+		self.writeInfo (3, 4, struct.pack ("<8i", 1, 0, 0, -1, 1,
+			1, 2 if sys.byteorder == "little" else 1, 65001))
+		self.writeInfo (4, 8, struct.pack ("<3d", sysmis, highest, lowest))
+		self.writeMultRespDefs (multRespDefs)
+		self.writeInfo (13, 1, "\t".join ("%s=%s" % (variable.shortName, variable.name)
+			for variable in self.variables))
+		veryLongStrings = "".join ("%s=%05d\0\t" % (variable.shortName, variable.varType)
+			for variable in self.variables if variable.varType > maxShortString)
+		if veryLongStrings:
+			self.writeInfo (14, 1, veryLongStrings)
+		self.writeInfo (20, 1, "UTF-8")
+		if longStringLabels:
+			info = []
+			for variable, labels in longStringLabels:
+				info.append (struct.pack ("<i", len (variable.name)) + variable.name +
+					struct.pack ("<2i", variable.varType, len (labels)))
+				for value, label in sorted (labels.items ()):
+					value = padded (encoded (value), variable.varType)
+					label = encoded (label)
+					info.append (struct.pack ("<i", len (value)) + value +
+						struct.pack ("<i", len (label)) + label)
+			self.writeInfo (21, 1, "".join (info))
+		f.write (struct.pack ("<2i", 999, 0))
+
+	def writeVariable (self, variable, label, format_, missing):
+		f = self.f
+		if missing and variable.varType > 8:
+			raise ValueError, "missing values are not supported for string variable %s wider than 8 bytes" %\
+				variable.name
+		missingCode, missingValues = 0, []
+		if missing:
+			if "lower" in missing and "upper" in missing:
+				missingValues = [missing ["lower"], missing ["upper"]]
+				if missing.get ("value") is not None:
+					missingValues.append (missing ["value"])
+				missingCode = -len (missingValues)
+			else:
+				missingValues = missing.get ("values") or []
+				if not isinstance (missingValues, (list, tuple)):
+					missingValues = [missingValues]
+				missingValues = missingValues [:3]
+				missingCode = len (missingValues)
+		for index, (shortName, width, dataBytes, caseBytes) in enumerate (variable.segments):
+			if variable.varType == 0:
+				code = formatCode (format_ or "F8.2")
+			elif index == 0 and format_ and variable.varType <= maxShortString:
+				code = formatCode (format_)
+			else:
+				code = formatCode ("A%d" % width)
+			hasLabel = 1 if label and index == 0 else 0
+			f.write (struct.pack ("<4i2i8s", 2, width, hasLabel,
+				missingCode if index == 0 else 0, code, code, padded (shortName, 8)))
+			if hasLabel:
+				text = encoded (label) [:255]
+				f.write (struct.pack ("<i", len (text)) + padded (text, len (text), 4))
+			if index == 0:
+				for value in missingValues:
+					if variable.varType == 0:
+						f.write (struct.pack ("<d", float (value)))
+					else:
+						f.write (padded (encoded (value), 8))
+			# Continuation records for the rest of the segment
+			for continuation in xrange (caseBytes // 8 - 1):
+				f.write (struct.pack ("<4i2i8s", 2, -1, 0, 0, 0, 0, spaces))
+
+	def writeMultRespDefs (self, multRespDefs):
+		normal, extended = [], []
+		for setName, definition in sorted (multRespDefs.items ()):
+			setName = encoded (setName)
+			if not setName.startswith ("$"):
+				setName = "$" + setName
+			label = encoded (definition.get ("label") or "")
+			setType = definition ["setType"]
+			if setType == "C":
+				text = "%s=C" % setName
+			else:
+				counted = encoded (definition ["countedValue"])
+				if setType == "E":
+					text = "%s=E %s %d %s" % (setName,
+						"11" if definition.get ("firstVarIsLabel") else "1",
+						len (counted), counted)
+				else:
+					text = "%s=D%d %s" % (setName, len (counted), counted)
+			text += " %d %s %s\n" % (len (label), label,
+				" ".join (encoded (name) for name in definition ["varNames"]))
+			(extended if setType == "E" else normal).append (text)
+		if normal:
+			self.writeInfo (7, 1, "".join (normal))
+		if extended:
+			self.writeInfo (19, 1, "".join (extended))
+
+	def writeInfo (self, subtype, size, data):
+		self.f.write (struct.pack ("<4i", 7, subtype, size, len (data) // size))
+		self.f.write (data)
+
+	def writerow (self, record):
+		if len (record) != len (self.variables):
+			raise ValueError, "Record %d has %d values, but there are %d variables" %\
+				(self.caseCount, len (record), len (self.variables))
+		elements = []
+		for variable, value in itertools.izip (self.variables, record):
+			elements.extend (variable.elements (value))
+		if self.compressed:
+			self.compress (elements)
+		else:
+			self.buffer.append ("".join (struct.pack ("<d", element)
+				if type (element) == float else element for element in elements))
+			self.bufferedBytes += len (self.buffer [-1])
+		self.caseCount += 1
+		if self.bufferedBytes >= self.bufferSize:
+			self.flush ()
+
+	# Accepts any iterable of records, or a dict mapping the UTF-8 encoded
+	# variable names to columns of equal length
+	def writerows (self, records):
+		if isinstance (records, dict):
+			records = itertools.izip (*[records [variable.name]
+				for variable in self.variables])
+		for record in records:
+			self.writerow (record)
+
+	def compress (self, elements):
+		codes = self.codes
+		raw = self.raw
+		for element in elements:
+			if type (element) == float:
+				if element == sysmis:
+					codes.append (codeSysmis)
+				else:
+					code = element + compressionBias
+					if 1 <= code <= 251 and code == int (code):
+						codes.append (int (code))
+					else:
+						codes.append (codeRaw)
+						raw.append (struct.pack ("<d", element))
+			elif element == spaces:
+				codes.append (codeSpaces)
+			else:
+				codes.append (codeRaw)
+				raw.append (element)
+			if len (codes) == 8:
+				self.buffer.append (struct.pack ("8B", *codes))
+				self.buffer.extend (raw)
+				self.bufferedBytes += 8*(len (raw) + 1)
+				del codes [:]
+				del raw [:]
+
+	def flush (self):
+		self.f.write ("".join (self.buffer))
+		self.buffer = []
+		self.bufferedBytes = 0
+
+	def close (self):
+		if self.f.closed:
+			return
+		if self.codes:
+			codes = self.codes + [0]*(8 - len (self.codes))
+			self.buffer.append (struct.pack ("8B", *codes))
+			self.buffer.extend (self.raw)
+		self.flush ()
+		# The case count in the file header
+		self.f.seek (80)
+		self.f.write (struct.pack ("<i", self.caseCount))
+		self.f.close ()
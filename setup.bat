@@ -12,4 +12,5 @@ mkdir .\output
 if exist spss xcopy /s /i .\spss .\output\spss
 move /y .\temp\sav2json.exe .\output\sav2json.exe
 move /y .\temp\json2sss.exe .\output\json2sss.exe
+move /y .\temp\json2sav.exe .\output\json2sav.exe
 rmdir .\temp /s/q
@@ -62,3 +62,15 @@ setup(
       name="json2sss",
       zipfile=None,
       version=savutilVersion)
+
+setup(
+      console=["json2sav.py"],
+      author="Iain MacKay",
+      author_email="iain@computable-functions.com",
+      contact="Iain MacKay",
+      options=options,
+      contact_email="iain@computable-functions.com",
+      description="json2sav - convert sav2json JSON data back into a .sav file",
+      name="json2sav",
+      zipfile=None,
+      version=savutilVersion)
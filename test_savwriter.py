@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+#
+# Round trip tests for savwriter. The files are read back by readSAV, which
+# follows the rules SPSS, PSPP and ReadStat use for very long strings: each
+# 256-byte segment holds 255 bytes of the value, the last segment its width.
+
+import os
+import struct
+import tempfile
+import unittest
+
+import savwriter
+
+def readSAV (savFileName):
+	data = open (savFileName, "rb").read ()
+	position = [0]
+	def read (format_):
+		values = struct.unpack_from (format_, data, position [0])
+		position [0] += struct.calcsize (format_)
+		return values
+	header = read ("<4s60s5id9s8s64s3x")
+	compressed, caseCount, bias = header [4], header [6], header [7]
+	widths, names, veryLong = [], [], {}
+	while True:
+		recordType, = read ("<i")
+		if recordType == 2:
+			width, hasLabel, missingCode, printFormat, writeFormat, name = read ("<5i8s")
+			if hasLabel:
+				length, = read ("<i")
+				position [0] += savwriter.roundUp (length, 4)
+			position [0] += 8*abs (missingCode)
+			if width != -1:
+				widths.append (width)
+				names.append (name.rstrip ())
+		elif recordType == 3:
+			count, = read ("<i")
+			for index in xrange (count):
+				position [0] += 8
+				length, = struct.unpack_from ("B", data, position [0])
+				position [0] += savwriter.roundUp (length + 1, 8)
+			read ("<2i")
+			position [0] += 4*read ("<i") [0]
+		elif recordType == 7:
+			subtype, size, count = read ("<3i")
+			if subtype == 14:
+				for entry in data [position [0]:position [0] + size*count].split ("\0\t"):
+					if entry:
+						name, width = entry.split ("=")
+						veryLong [name] = int (width)
+			position [0] += size*count
+		elif recordType == 999:
+			read ("<i")
+			break
+
+	elements = []
+	if compressed:
+		while position [0] < len (data):
+			codes = read ("8B")
+			for code in codes:
+				if code == 0:
+					continue
+				if code == savwriter.codeRaw:
+					elements.append (data [position [0]:position [0] + 8])
+					position [0] += 8
+				elif code == savwriter.codeSpaces:
+					elements.append (savwriter.spaces)
+				elif code == savwriter.codeSysmis:
+					elements.append (None)
+				else:
+					elements.append (struct.pack ("<d", code - bias))
+	else:
+		elements = [data [index:index + 8] for index in xrange (position [0], len (data), 8)]
+
+	cases = []
+	elementsPerCase = len (elements) // caseCount
+	for case in xrange (caseCount):
+		caseElements = elements [case*elementsPerCase:(case + 1)*elementsPerCase]
+		segments = []
+		for width in widths:
+			count = savwriter.roundUp (width, 8) // 8 or 1
+			raw, caseElements = caseElements [:count], caseElements [count:]
+			if width == 0:
+				value = None if raw [0] is None else struct.unpack ("<d", raw [0]) [0]
+				segments.append (None if value == savwriter.sysmis else value)
+			else:
+				segments.append ("".join (raw) [:width])
+		values = []
+		index = 0
+		while index < len (names):
+			width = veryLong.get (names [index])
+			if width is None:
+				values.append (segments [index])
+				index += 1
+				continue
+			count = savwriter.roundUp (width, savwriter.segmentData) // savwriter.segmentData
+			values.append ("".join (segment [:255] for segment in segments [index:index + count]))
+			index += count
+		cases.append ([value.rstrip (" ").decode ("utf-8") if isinstance (value, str) else value
+			for value in values])
+	return cases
+
+class VeryLongStringTest (unittest.TestCase):
+	def setUp (self):
+		handle, self.savFileName = tempfile.mkstemp (".sav")
+		os.close (handle)
+
+	def tearDown (self):
+		os.remove (self.savFileName)
+
+	def roundTrip (self, compressed):
+		ascii = u"".join (unichr (ord ("A") + index % 26) for index in xrange (600))
+		# Multibyte characters fall across the segment boundaries
+		multibyte = (u"café €ü " * 100) [:290]
+		records = [
+			[ascii, 1, multibyte],
+			[multibyte, 2, ascii],
+			[u"", None, None]
+		]
+		with savwriter.SavWriter (self.savFileName, ["long", "number", "longer"],
+			{"long": 600, "number": 0, "longer": 1000}, compressed=compressed) as writer:
+			writer.writerows (records)
+		self.assertEqual (readSAV (self.savFileName), [
+			[ascii, 1.0, multibyte],
+			[multibyte, 2.0, ascii],
+			[u"", None, u""]
+		])
+
+	def testCompressed (self):
+		self.roundTrip (True)
+
+	def testUncompressed (self):
+		self.roundTrip (False)
+
+if __name__ == "__main__":
+	unittest.main ()
@@ -31,7 +31,8 @@ import csv
 import numbers
 import sys
 
-from itertools import izip
+from cStringIO import StringIO
+from itertools import islice, izip
 
 pass_throughs = [
     'register_dialect',
@@ -79,6 +80,28 @@ def _stringify_list(l, encoding, errors='strict'):
         raise csv.Error(str(e))
 
 
+_missing = object()
+
+# Cell types that _stringify returns unchanged
+_plain_types = frozenset([str, int, long, float, bool])
+
+
+def _stringify_rows(rows, encoding, errors='strict'):
+    """Encode a batch of rows, leaving byte strings and numbers alone and
+    only calling _stringify for less common cell types."""
+    unicode_ = unicode
+    plain_types = _plain_types
+    try:
+        return [[(s.encode(encoding, errors) if type(s) is unicode_ else
+                  '' if s is None else
+                  s if type(s) in plain_types else
+                  _stringify(s, encoding, errors))
+                 for s in row]
+                for row in rows]
+    except TypeError as e:
+        raise csv.Error(str(e))
+
+
 def _unicodify(s, encoding):
     if s is None:
         return None
@@ -97,20 +120,49 @@ class UnicodeWriter(object):
     >>> w = unicodecsv.writer(f, encoding='utf-8')
     >>> f.seek(0)
     >>> r = unicodecsv.reader(f, encoding='utf-8')
+
+    With buffer_size, rows are formatted into a memory buffer which is
+    written to f whenever it exceeds buffer_size bytes, and by flush().
     """
+    batch_size = 1000
+
     def __init__(self, f, dialect=csv.excel, encoding='utf-8', errors='strict',
                  *args, **kwds):
         self.encoding = encoding
-        self.writer = csv.writer(f, dialect, *args, **kwds)
+        self.f = f
+        self.buffer_size = buffer_size = kwds.pop('buffer_size', 0)
+        if buffer_size:
+            self.buffer = StringIO()
+            self.writer = csv.writer(self.buffer, dialect, *args, **kwds)
+        else:
+            self.buffer = None
+            self.writer = csv.writer(f, dialect, *args, **kwds)
         self.encoding_errors = errors
 
     def writerow(self, row):
-        return self.writer.writerow(
-                _stringify_list(row, self.encoding, self.encoding_errors))
+        result = self.writer.writerow(
+                _stringify_rows((row,), self.encoding, self.encoding_errors)[0])
+        if self.buffer is not None and self.buffer.tell() >= self.buffer_size:
+            self.flush()
+        return result
 
     def writerows(self, rows):
-        for row in rows:
-            self.writerow(row)
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                break
+            self.writer.writerows(
+                _stringify_rows(batch, self.encoding, self.encoding_errors))
+            if self.buffer is not None and \
+                    self.buffer.tell() >= self.buffer_size:
+                self.flush()
+
+    def flush(self):
+        if self.buffer is not None:
+            self.f.write(self.buffer.getvalue())
+            self.buffer.seek(0)
+            self.buffer.truncate()
 
     @property
     def dialect(self):
@@ -135,6 +187,7 @@ class UnicodeReader(object):
         self.encoding_errors = errors
         self._parse_numerics = bool(
             self.dialect.quoting & csv.QUOTE_NONNUMERIC)
+        self._memo = {}
 
     def next(self):
         row = self.reader.next()
@@ -153,6 +206,60 @@ class UnicodeReader(object):
     def __iter__(self):
         return self
 
+    # Cell values up to memo_length bytes are decoded once and shared
+    memo_length = 16
+    memo_size = 2**16
+
+    def read_block(self, size=1000, columns=None, empty_as_none=False):
+        """Return up to size rows, or [] at end of file.
+
+        columns (a slice or a sequence of indexes) selects the cells to
+        decode, and empty_as_none maps empty cells to None."""
+        if columns is None or isinstance(columns, slice):
+            select = None
+        else:
+            select = columns
+            columns = None
+        empty = None if empty_as_none else u''
+        memo = self._memo
+        memo[''] = empty
+        memo_get = memo.get
+        memo_length = self.memo_length
+        missing = _missing
+        encoding = self.encoding
+        encoding_errors = self.encoding_errors
+        unicode_ = unicode
+        block = []
+        for row in islice(self.reader, size):
+            if select is not None:
+                row = [row[index] for index in select]
+            elif columns is not None:
+                row = row[columns]
+            cells = []
+            append = cells.append
+            for value in row:
+                cell = memo_get(value, missing)
+                if cell is missing:
+                    if isinstance(value, float):
+                        cell = value
+                    else:
+                        cell = unicode_(value, encoding, encoding_errors)
+                        if len(value) <= memo_length:
+                            if len(memo) >= self.memo_size:
+                                memo.clear()
+                                memo[''] = empty
+                            memo[value] = cell
+                append(cell)
+            block.append(cells)
+        return block
+
+    def iter_blocks(self, size=1000, columns=None, empty_as_none=False):
+        while True:
+            block = self.read_block(size, columns, empty_as_none)
+            if not block:
+                break
+            yield block
+
     @property
     def dialect(self):
         return self.reader.dialect